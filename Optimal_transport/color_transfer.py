@@ -8,6 +8,51 @@ michielfmstock@gmail.com
 Color transfer using optimal transport.
 
 Takes to color scheme of one image and transforms it to another image
+
+The images are kept as 8-bit integers (.npy files are memory-mapped) and the
+image to transform is processed in tiles of rows, such that only one tile is
+converted to floats at a time. If the name of the output ends with .npy, the
+result is written to a memory-mapped file, so images larger than the memory
+can be processed.
+
+The fitted mapping is not evaluated for every pixel: it is evaluated once
+for every distinct color of the image (-mapping unique), or on a regular
+grid of colors that is interpolated trilinearly for every distinct color
+(-mapping grid). The grid is the fast path for photographs with many
+distinct colors, as it costs lut_size^3 evaluations of the mapping whatever
+the image. By default (-mapping auto), the grid is used if the image has
+more than 4 lut_size^3 distinct colors. The mapped colors are applied to the
+tiles with a lookup table indexed by the 24-bit colors.
+
+Besides a single pair of images, a manifest (CSV file with a header row
+naming the columns from, to and out, one job per row, rows starting with #
+are skipped) or a directory of images to recolor with one palette image can be
+processed in a pool of worker processes. With -reuse_mapping, the mapping is
+only fitted once for every image to take the color from (these fits run in
+the pool as well). This is not the default: the mapping is fitted on the
+colors of the image to transform, so reusing it is only appropriate for
+images with similar colors. To apply one fixed transfer to many images, save
+it as a palette.
+
+A fitted transfer can be saved as a palette (-save_palette), a directory with
+the sampled colors, the transport plan and the targets of the mapping as .npy
+files, and applied later (-palette) without the reference image or solving
+the optimal transport problem again.
+
+The colors of both images are summarized by at most n_pixels weighted colors
+(-sampling): by default a k-means codebook fitted on a histogram of all
+pixels, weighted by the number of pixels in every cluster. These weights are
+used as the marginals of the transport problem, so far fewer colors are
+needed than with uniformly sampled pixels. The sampling is deterministic for
+a given -seed.
+
+Usage:
+    python color_transfer.py -f Figures/PC.jpg -t Figures/PB.jpg -o test.jpg
+    python color_transfer.py -manifest jobs.csv -n_jobs 8
+    python color_transfer.py -f palette.jpg -to_dir photos -out_dir recolored \
+            -n_jobs 8 -reuse_mapping
+    python color_transfer.py -f Figures/PC.jpg -t Figures/PB.jpg -save_palette PC
+    python color_transfer.py -palette PC -to_dir photos -out_dir recolored
 """
 
 import numpy as np
@@ -15,52 +60,90 @@ from optimal_transport import OptimalTransport
 from skimage import io
 from skimage.color import rgb2hsv, hsv2rgb
 from sklearn.neighbors import KNeighborsRegressor
+from sklearn.cluster import KMeans
 import argparse
+import csv
+import json
+import os
+import sys
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import warnings
 warnings.simplefilter("ignore", UserWarning)
 
 
 
-n_pixels = 1000
-lam = 10
-n_neighbors = 10
-name_from = 'Figures/PB2PC.jpg'
-name_to = 'Figures/PC.jpg'
-name_out = 'test.jpg'
-
-arg_parser = argparse.ArgumentParser()
-
-arg_parser.add_argument('-f', '--fr', type=str,default='Figures/PC.jpg',
-                help='image to take the color from')
-arg_parser.add_argument('-t', '--to', type=str,default='Figures/PB.jpg',
-                help='image transform')
-arg_parser.add_argument('-o', '--out', type=str,default='test.jpg',
-                help='name of the output image')
-arg_parser.add_argument('-n_pixels', type=int, default=1000,
-                help='number of pixels to sample (default: 1000)')
-arg_parser.add_argument('-lam', type=float, default=10,
-                help='value for entropic regularization (default: 10)')
-arg_parser.add_argument('-n_neighbors', type=int, default=10,
-                help='number of neighbors in the KNN (default: 10)')
-arg_parser.add_argument('-metric', type=str, default='mahalanobis',#mahalanobis
-                help='distance metric used for cost matrix (default: Mahalanobis)')
-arg_parser.add_argument('-save_color_distribution', type=bool, default=False,
-                help='save plots of the to and from color distribition')
-arg_parser.add_argument('--hsv', dest='use_hsv', default=False, const=True,
-                action='store_const',
-                help='process the image in hsv space (default: in RGB space)')
-args = arg_parser.parse_args()
-
-# get arguments
-name_from = args.fr
-name_to = args.to
-name_out = args.out
-n_pixels = args.n_pixels
-lam = args.lam
-n_neighbors = args.n_neighbors
-distance_metric = args.metric
-save_col_distribution = args.save_color_distribution
+def parse_arguments(argv=None):
+    """Parses the arguments of the command line"""
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument('-f', '--fr', type=str,default='Figures/PC.jpg',
+                    help='image to take the color from')
+    arg_parser.add_argument('-t', '--to', type=str,default='Figures/PB.jpg',
+                    help='image transform')
+    arg_parser.add_argument('-o', '--out', type=str,default='test.jpg',
+                    help='name of the output image')
+    arg_parser.add_argument('-n_pixels', type=int, default=1000,
+                    help='number of (weighted) colors to sample (default: 1000)')
+    arg_parser.add_argument('-sampling', type=str, default='kmeans',
+                    choices=['kmeans', 'histogram', 'uniform'],
+                    help='summarize the colors by a k-means codebook, the most '
+                         'populated bins of a histogram or random pixels '
+                         '(default: kmeans)')
+    arg_parser.add_argument('-seed', type=int, default=0,
+                    help='seed for the sampling of the colors (default: 0)')
+    arg_parser.add_argument('-lam', type=float, default=10,
+                    help='value for entropic regularization (default: 10)')
+    arg_parser.add_argument('-max_iter', type=int, default=None,
+                    help='maximal number of Sinkhorn iterations (default: no limit)')
+    arg_parser.add_argument('-max_time', type=float, default=None,
+                    help='time budget for the Sinkhorn iterations in seconds '
+                         '(default: no limit)')
+    arg_parser.add_argument('-n_neighbors', type=int, default=10,
+                    help='number of neighbors in the KNN (default: 10)')
+    arg_parser.add_argument('-metric', type=str, default='mahalanobis',#mahalanobis
+                    help='distance metric used for cost matrix (default: Mahalanobis)')
+    arg_parser.add_argument('-save_color_distribution', type=bool, default=False,
+                    help='save plots of the to and from color distribition')
+    arg_parser.add_argument('--hsv', dest='use_hsv', default=False, const=True,
+                    action='store_const',
+                    help='process the image in hsv space (default: in RGB space)')
+    arg_parser.add_argument('-tile_rows', type=int, default=256,
+                    help='number of rows of the image processed at once (default: 256)')
+    arg_parser.add_argument('-mapping', type=str, default='auto',
+                    choices=['auto', 'unique', 'grid', 'direct'],
+                    help='evaluate the color mapping for every distinct color, on '
+                         'a grid (the fast path for images with many colors) or '
+                         'for every pixel, auto uses the grid if there are more '
+                         'than 4 lut_size^3 distinct colors (default: auto)')
+    arg_parser.add_argument('-lut_size', type=int, default=33,
+                    help='number of grid nodes per channel (default: 33)')
+    arg_parser.add_argument('-manifest', type=str, default=None,
+                    help='CSV file with the columns from, to and out (header '
+                         'row) of every job')
+    arg_parser.add_argument('-to_dir', type=str, default=None,
+                    help='transform all images in this directory (with the '
+                         'color of --fr)')
+    arg_parser.add_argument('-out_dir', type=str, default='.',
+                    help='directory for the output images of -to_dir (default: .)')
+    arg_parser.add_argument('-n_jobs', type=int, default=1,
+                    help='number of worker processes (default: 1)')
+    arg_parser.add_argument('-max_in_flight', type=int, default=None,
+                    help='maximal number of images submitted to the workers '
+                         '(default: 2 * n_jobs)')
+    arg_parser.add_argument('-reuse_mapping', default=False, action='store_true',
+                    help='fit the mapping once for every image to take the '
+                         'color from (on its first image to transform). Not '
+                         'the default, as the mapping depends on the colors '
+                         'of the image to transform: only use it for images '
+                         'with similar colors, or save a palette')
+    arg_parser.add_argument('-save_palette', type=str, default=None,
+                    help='fit the transfer from --fr to --to and save it in '
+                         'this directory')
+    arg_parser.add_argument('-palette', type=str, default=None,
+                    help='apply the transfer saved in this directory')
+    return arg_parser.parse_args(argv)
 
 def im2mat(I):
     """Converts and image to matrix (one pixel per line)"""
@@ -73,33 +156,210 @@ def mat2im(X, shape):
 def minmax(I):
     return np.clip(I, 0, 1)
 
-def main():
-    # read the images
-    image_from = io.imread(name_from) / 256
-    image_to = io.imread(name_to) / 256
+def read_image(name):
+    """Reads an image as 8-bit integers, .npy files are memory-mapped"""
+    if name.endswith('.npy'):
+        return np.load(name, mmap_mode='r')
+    return io.imread(name)
+
+def open_output(name, shape):
+    """8-bit output image, memory-mapped if name ends with .npy"""
+    if name.endswith('.npy'):
+        return np.lib.format.open_memmap(name, mode='w+', dtype=np.uint8,
+                                         shape=shape)
+    return np.empty(shape, dtype=np.uint8)
+
+def to_colors(pixels, use_hsv=False):
+    """Converts 8-bit pixels (..., 3) to float32 colors (HSV if requested)"""
+    colors = pixels.astype(np.float32) / 256
+    if use_hsv:
+        colors = rgb2hsv(colors.reshape((1, -1, 3))).reshape(colors.shape)
+    return colors.astype(np.float32)
+
+def to_pixels(colors, use_hsv=False):
+    """Converts colors (..., 3) back to 8-bit RGB pixels"""
+    colors = minmax(colors)
+    if use_hsv:
+        colors = hsv2rgb(colors.reshape((1, -1, 3))).reshape(colors.shape)
+    return np.round(colors * 255).astype(np.uint8)
+
+def pack(pixels):
+    """Encodes 8-bit RGB pixels (..., 3) as 24-bit integers"""
+    pixels = pixels.reshape((-1, 3)).astype(np.uint32)
+    return (pixels[:,0] << 16) | (pixels[:,1] << 8) | pixels[:,2]
+
+def unpack(packed):
+    """Decodes 24-bit integers to 8-bit RGB pixels (n x 3)"""
+    return np.stack([packed >> 16, packed >> 8, packed], 1).astype(np.uint8)
+
+def unique_colors(image, tile_rows=256):
+    """Sorted distinct colors of an 8-bit image (as 24-bit integers)"""
+    present = np.zeros(2**24, dtype=bool)
+    for start in range(0, image.shape[0], tile_rows):
+        present[pack(image[start:start+tile_rows])] = True
+    return np.flatnonzero(present).astype(np.uint32)
+
+def color_histogram(image, bits=5, tile_rows=256):
+    """
+    Histogram of the colors of an 8-bit image with 2^bits bins per channel
+
+    Output:
+        - colors : mean 8-bit color of the pixels in every nonempty bin
+        - counts : number of pixels in every nonempty bin
+    """
+    n_bins = 2**(3 * bits)
+    counts = np.zeros(n_bins)
+    sums = np.zeros((n_bins, 3))
+    for start in range(0, image.shape[0], tile_rows):
+        pixels = im2mat(image[start:start+tile_rows])
+        bins = pixels.astype(np.intp) >> (8 - bits)
+        index = (bins[:,0] << (2 * bits)) | (bins[:,1] << bits) | bins[:,2]
+        counts += np.bincount(index, minlength=n_bins)
+        for channel in range(3):
+            sums[:,channel] += np.bincount(index, pixels[:,channel], n_bins)
+    nonempty = counts > 0
+    return sums[nonempty] / counts[nonempty].reshape((-1, 1)), counts[nonempty]
+
+def sample_colors(image, n_pixels, sampling='kmeans', seed=None,
+                  use_hsv=False, tile_rows=256):
+    """
+    Summarizes the colors of an 8-bit image by at most n_pixels weighted
+    colors (only the first three channels are used, alpha is ignored)
+
+    Inputs:
+        - image : 8-bit image (possibly memory-mapped)
+        - n_pixels : maximal number of colors
+        - sampling : 'kmeans' clusters a histogram of 32^3 bins (weighted
+                by the counts), 'histogram' takes the most populated bins of
+                a histogram of 16^3 bins, 'uniform' takes random pixels
+        - seed : seed of the random number generator
+        - use_hsv : return the colors in HSV space
+        - tile_rows : number of rows per tile to compute the histograms
+
+    Output:
+        - colors : float32 colors (n x 3)
+        - weights : weights of the colors, sum to one
+    """
+    image = image[:,:,:3]
+    if sampling == 'uniform':
+        X = im2mat(image)
+        random_state = np.random.RandomState(seed)
+        colors = X[random_state.randint(0, X.shape[0], n_pixels)]
+        weights = np.ones(n_pixels)
+    elif sampling == 'histogram':
+        colors, weights = color_histogram(image, 4, tile_rows)
+        largest = np.argsort(-weights, kind='stable')[:n_pixels]
+        colors, weights = colors[largest], weights[largest]
+    else:
+        colors, weights = color_histogram(image, 5, tile_rows)
+        if len(weights) > n_pixels:
+            kmeans = KMeans(n_pixels, n_init=1, random_state=seed)
+            kmeans.fit(colors, sample_weight=weights)
+            weights = np.bincount(kmeans.labels_, weights, n_pixels)
+            colors = kmeans.cluster_centers_[weights > 0]
+            weights = weights[weights > 0]
+    return to_colors(colors, use_hsv), weights / weights.sum()
+
+def grid_lut(transfer, n_nodes=33):
+    """
+    Evaluates a color mapping on a regular grid in the unit cube
 
-    # change to hsv domain (if requested)
-    if args.use_hsv:
-        image_from[:] = rgb2hsv(image_from)
-        image_to[:] = rgb2hsv(image_to)
+    Output:
+        - lut : mapped colors (n_nodes x n_nodes x n_nodes x 3)
+    """
+    nodes = np.linspace(0, 1, n_nodes, dtype=np.float32)
+    grid = np.stack(np.meshgrid(nodes, nodes, nodes, indexing='ij'), -1)
+    return mat2im(transfer(grid.reshape((-1, 3))),
+                  grid.shape).astype(np.float32)
 
-    # get shapes
-    shape_from = image_from.shape
-    shape_to = image_to.shape
+def apply_lut(colors, lut):
+    """
+    Maps colors (n x 3) in the unit cube by trilinear interpolation in a
+    lookup table made by grid_lut
+    """
+    n_nodes = lut.shape[0]
+    position = np.clip(colors, 0, 1) * (n_nodes - 1)
+    index = np.minimum(position.astype(np.intp), n_nodes - 2)
+    fraction = (position - index).astype(np.float32)
+    weights = (1 - fraction, fraction)
+    base = (index[:,0] * n_nodes + index[:,1]) * n_nodes + index[:,2]
+    lut = lut.reshape((-1, 3))
+    mapped = np.zeros(colors.shape, dtype=np.float32)
+    for i, j, k in product((0, 1), repeat=3):
+        weight = weights[i][:,0] * weights[j][:,1] * weights[k][:,2]
+        mapped += weight.reshape((-1, 1)) *\
+                lut[base + (i * n_nodes + j) * n_nodes + k]
+    return mapped
 
-    # flatten
-    X_from = im2mat(image_from)
-    X_to = im2mat(image_to)
+def transfer_image(image, transfer, out, tile_rows=256, mapping='auto',
+                   lut_size=33, use_hsv=False):
+    """
+    Applies a color mapping to an image in tiles of rows, only the first three
+    (RGB) channels are mapped, other channels (alpha) are copied
 
-    # number of pixes
-    n_pixels_from = X_from.shape[0]
-    n_pixels_to = X_to.shape[0]
+    Inputs:
+        - image : 8-bit image (possibly memory-mapped)
+        - transfer : function mapping an array of colors (n x 3) to new
+                colors
+        - out : 8-bit array (possibly memory-mapped) for the result
+        - tile_rows : number of rows per tile
+        - mapping : 'unique' evaluates transfer once for every distinct
+                color of the image, 'grid' on a grid of lut_size^3 colors
+                that is interpolated for every distinct color (faster for
+                images with many colors), 'auto' uses 'grid' if there are
+                more than 4 lut_size^3 distinct colors, else 'unique',
+                'direct' evaluates transfer for every pixel
+        - lut_size : number of grid nodes per channel
+        - use_hsv : apply the mapping in HSV space
 
-    # subsample
-    X_from_ss = X_from[np.random.randint(0, n_pixels_from-1, n_pixels),:]
-    X_to_ss = X_to[np.random.randint(0, n_pixels_to-1, n_pixels),:]
+    Output:
+        - out
+    """
+    if mapping != 'direct':  # lookup table for all 24-bit colors
+        colors = unique_colors(image[:,:,:3], tile_rows)
+        if mapping == 'auto':
+            mapping = 'grid' if len(colors) > 4 * lut_size**3 else 'unique'
+        if mapping == 'grid':
+            lut = grid_lut(transfer, lut_size)
+            transfer = lambda X : apply_lut(X, lut)
+        table = np.zeros((2**24, 3), dtype=np.uint8)
+        table[colors] = to_pixels(transfer(to_colors(unpack(colors),
+                                                     use_hsv)), use_hsv)
+    for start in range(0, image.shape[0], tile_rows):
+        tile = image[start:start+tile_rows,:,:3]
+        if mapping == 'direct':
+            pixels = to_pixels(transfer(im2mat(to_colors(tile, use_hsv))),
+                               use_hsv)
+        else:
+            pixels = np.take(table, pack(tile), axis=0)
+        out[start:start+tile_rows,:,:3] = mat2im(pixels, tile.shape)
+        out[start:start+tile_rows,:,3:] = image[start:start+tile_rows,:,3:]
+    return out
 
-    if save_col_distribution:
+def save_image(name, image):
+    """Writes an image (flushes it if it is memory-mapped)"""
+    if name.endswith('.npy'):
+        image.flush()
+    else:
+        io.imsave(name, image)
+
+def fit_palette(image_from, image_to, args):
+    """
+    Fits the transfer from the colors of image_to to those of image_from
+
+    Output:
+        - palette : dictionary with the sampled colors of both images
+                (support_from and support_to) and their weights (weights_from
+                and weights_to), the transport plan and the colors the
+                sampled colors of image_to are mapped to (targets)
+    """
+    # weighted colors of both images (in hsv domain if requested)
+    X_from_ss, w_from = sample_colors(image_from, args.n_pixels, args.sampling,
+                                      args.seed, args.use_hsv, args.tile_rows)
+    X_to_ss, w_to = sample_colors(image_to, args.n_pixels, args.sampling,
+                                  args.seed, args.use_hsv, args.tile_rows)
+
+    if args.save_color_distribution:
         import matplotlib.pyplot as plt
         import seaborn as sns
         sns.set_style('white')
@@ -119,18 +379,216 @@ def main():
         fig.savefig('color_distributions.png')
 
     # optimal tranportation
-    ot_color = OptimalTransport(X_to_ss, X_from_ss, lam=lam,
-                                    distance_metric=distance_metric)#euclidean distance_metric
+    ot_color = OptimalTransport(X_to_ss, X_from_ss, r=w_to, c=w_from,
+                                lam=args.lam, distance_metric=args.metric,
+                                solver_options=dict((name, value)
+                                    for name, value in [('max_iter', args.max_iter),
+                                                        ('max_time', args.max_time)]
+                                    if value is not None))
+    # every color of image_to is mapped to the mean of its transported mass
+    targets = ot_color.P / ot_color.P.sum(1).reshape((-1, 1)) @ X_from_ss
+    return {'support_from' : X_from_ss, 'support_to' : X_to_ss,
+            'weights_from' : w_from.astype(np.float32),
+            'weights_to' : w_to.astype(np.float32),
+            'plan' : ot_color.P.astype(np.float32),
+            'targets' : targets.astype(np.float32)}
 
-    # model transfer
+def palette_model(palette, n_neighbors=10):
+    """Regression model mapping colors (n x 3) as fitted in the palette"""
+    n_neighbors = min(n_neighbors, len(palette['support_to']))
     transfer_model = KNeighborsRegressor(n_neighbors=n_neighbors)
-    transfer_model.fit(X_to_ss, n_pixels * ot_color.P @ X_from_ss)
-    X_transfered = transfer_model.predict(X_to)
+    transfer_model.fit(palette['support_to'], palette['targets'])
+    return transfer_model
+
+def fit_transfer(image_from, image_to, args):
+    """
+    Fits the color mapping from the colors of image_to to those of
+    image_from
+
+    Output:
+        - transfer_model : regression model mapping colors (n x 3)
+    """
+    return palette_model(fit_palette(image_from, image_to, args),
+                         args.n_neighbors)
+
+def save_palette(directory, palette, args):
+    """
+    Saves a palette as .npy files in a directory, with the settings used to
+    fit it in settings.json
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, array in palette.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    with open(os.path.join(directory, 'settings.json'), 'w') as settings:
+        json.dump({'use_hsv' : args.use_hsv, 'n_neighbors' : args.n_neighbors,
+                   'lam' : args.lam, 'metric' : args.metric,
+                   'n_pixels' : args.n_pixels, 'sampling' : args.sampling,
+                   'seed' : args.seed}, settings, indent=2)
+
+def load_palette(directory):
+    """
+    Loads a palette saved by save_palette, the arrays are memory-mapped
+
+    Output:
+        - palette : dictionary with the arrays
+        - settings : dictionary with the settings used to fit it
+    """
+    palette = dict((name, np.load(os.path.join(directory, name + '.npy'),
+                                  mmap_mode='r'))
+                   for name in ['support_from', 'support_to', 'weights_from',
+                                'weights_to', 'plan', 'targets']
+                   if os.path.exists(os.path.join(directory, name + '.npy')))
+    with open(os.path.join(directory, 'settings.json')) as settings:
+        return palette, json.load(settings)
+
+def process_job(job, args, transfer_model=None):
+    """
+    Transforms one image, job is a tuple (name_from, name_to, name_out), the
+    mapping is fitted if no transfer_model is given
+    """
+    name_from, name_to, name_out = job
+    # read the images (as 8-bit integers)
+    image_to = read_image(name_to)
+    if transfer_model is None:
+        transfer_model = fit_transfer(read_image(name_from), image_to, args)
+
+    # apply the mapping tile by tile
+    image_transferd = transfer_image(image_to, transfer_model.predict,
+                                     open_output(name_out, image_to.shape),
+                                     args.tile_rows, args.mapping,
+                                     args.lut_size, args.use_hsv)
+    save_image(name_out, image_transferd)
+    return name_out
+
+def list_jobs(args):
+    """
+    Lists the jobs (name_from, name_to, name_out) of the manifest, the
+    directory or the single pair of images
+    """
+    if args.manifest is not None:
+        with open(args.manifest) as manifest:
+            rows = csv.DictReader(manifest)
+            assert set(['from', 'to', 'out']) <= set(rows.fieldnames or []),\
+                    'the manifest needs a header row with from, to and out'
+            return [(row['from'], row['to'], row['out']) for row in rows
+                    if not (row['from'] or '').startswith('#')]
+    if args.to_dir is not None:
+        if not os.path.isdir(args.out_dir):
+            os.makedirs(args.out_dir)
+        return [(args.fr, os.path.join(args.to_dir, name),
+                 os.path.join(args.out_dir, name))
+                for name in sorted(os.listdir(args.to_dir))
+                if os.path.isfile(os.path.join(args.to_dir, name))]
+    return [(args.fr, args.to, args.out)]
+
+def report(futures, jobs):
+    """
+    Prints the result of finished jobs (removed from the dictionary jobs with
+    the job of every future), returns the number of failures
+    """
+    n_failed = 0
+    for future in futures:
+        job = jobs.pop(future)
+        try:
+            print(future.result())
+        except Exception as error:
+            n_failed += 1
+            print('{} failed: {}'.format(job[1], error), file=sys.stderr)
+    return n_failed
+
+def fit_job(job, args):
+    """Fits the mapping of a job (name_from, name_to, name_out)"""
+    return fit_transfer(read_image(job[0]), read_image(job[1]), args)
+
+def fit_sources(jobs, args, executor=None):
+    """
+    Fits the mapping once for every image to take the color from (on its
+    first image to transform), in parallel if an executor is given
+
+    Output:
+        - transfer_models : dictionary with the model of every image to take
+                the color from
+        - failed : set of images to take the color from that could not be
+                fitted
+    """
+    first_jobs = {}
+    for job in jobs:
+        first_jobs.setdefault(job[0], job)
+    if executor is not None:
+        futures = dict((name_from, executor.submit(fit_job, job, args))
+                       for name_from, job in first_jobs.items())
+    transfer_models = {}
+    failed = set()
+    for name_from, job in first_jobs.items():
+        try:
+            if executor is None:
+                transfer_models[name_from] = fit_job(job, args)
+            else:
+                transfer_models[name_from] = futures[name_from].result()
+        except Exception as error:
+            failed.add(name_from)
+            print('fitting {} failed: {}'.format(name_from, error),
+                  file=sys.stderr)
+    return transfer_models, failed
+
+def run_batch(jobs, args):
+    """
+    Processes the jobs in a pool of args.n_jobs worker processes, with at
+    most args.max_in_flight images submitted at once
+
+    Output:
+        - number of failed jobs
+    """
+    transfer_models = {}
+    failed = set()
+    reuse_mapping = args.reuse_mapping and args.palette is None
+    if args.palette is not None:  # the same saved mapping for all jobs
+        palette, settings = load_palette(args.palette)
+        args.use_hsv = settings['use_hsv']
+        transfer_model = palette_model(palette, settings['n_neighbors'])
+        transfer_models = dict((job[0], transfer_model) for job in jobs)
+    if args.n_jobs == 1:
+        if reuse_mapping:
+            transfer_models, failed = fit_sources(jobs, args)
+        n_failed = sum(job[0] in failed for job in jobs)
+        for job in jobs:
+            if job[0] in failed:
+                continue
+            try:
+                print(process_job(job, args, transfer_models.get(job[0])))
+            except Exception as error:
+                n_failed += 1
+                print('{} failed: {}'.format(job[1], error), file=sys.stderr)
+        return n_failed
+    max_in_flight = args.max_in_flight or 2 * args.n_jobs
+    submitted = {}
+    pending = set()
+    with ProcessPoolExecutor(args.n_jobs) as executor:
+        if reuse_mapping:  # the fits run in the pool as well
+            transfer_models, failed = fit_sources(jobs, args, executor)
+        n_failed = sum(job[0] in failed for job in jobs)
+        for job in jobs:
+            if job[0] in failed:
+                continue
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                n_failed += report(done, submitted)
+            future = executor.submit(process_job, job, args,
+                                     transfer_models.get(job[0]))
+            submitted[future] = job
+            pending.add(future)
+        n_failed += report(wait(pending)[0], submitted)
+    return n_failed
 
-    image_transferd = minmax(mat2im(X_transfered, shape_to))
-    if args.use_hsv:
-        image_transferd[:] = hsv2rgb(image_transferd)
-    io.imsave(name_out, image_transferd)
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.save_palette is not None:
+        save_palette(args.save_palette, fit_palette(read_image(args.fr),
+                                                    read_image(args.to), args),
+                     args)
+        return 0
+    return run_batch(list_jobs(args), args)
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main() > 0)
@@ -0,0 +1,115 @@
+"""
+Created on Sunday 18 October 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Cache for cost matrices between two sets of points
+
+The cost matrices are identified by a hash of the content of the points and
+the name of the metric, such that repeated runs over the same data skip the
+computation of the distances. The matrices are kept in memory up to a
+maximal number of bytes, the least recently used ones are evicted first.
+Optionally, every matrix is also saved in a directory and loaded again as a
+memory-mapped file, also in later sessions. These memory maps are indexed
+separately and do not count towards the number of bytes in memory.
+"""
+
+import numpy as np
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from sklearn.metrics.pairwise import pairwise_distances
+from optimal_transport import metric_params
+
+class CostMatrixCache(object):
+    """
+    LRU cache of cost matrices, bounded by memory and optionally backed by
+    .npy files in a directory
+    """
+    def __init__(self, max_bytes=2**30, directory=None):
+        """
+        Inputs:
+            - max_bytes : maximal size of the matrices kept in memory
+                    (default: 1 GB)
+            - directory : directory to store the matrices in (default: None,
+                    only kept in memory)
+        """
+        super(CostMatrixCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.matrices = OrderedDict()
+        self.mapped = {}  # memory maps of files in the directory
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, X1, X2, metric):
+        """
+        Hash of the content of the two sets of points and the metric
+        """
+        hash_ = sha1(metric.encode())
+        for X in (X1, X2):
+            X = np.ascontiguousarray(X)
+            hash_.update(str((X.shape, X.dtype.str)).encode())
+            hash_.update(X.data)
+        return hash_.hexdigest()
+
+    def path(self, key):
+        """
+        File of a matrix in the directory
+        """
+        return os.path.join(self.directory, key + '.npy')
+
+    def add(self, key, M):
+        """
+        Keeps a matrix in memory, evicting the least recently used ones
+        """
+        if M.nbytes > self.max_bytes:
+            return
+        self.matrices[key] = M
+        self.n_bytes += M.nbytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self.matrices.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+
+    def get(self, X1, X2, metric='euclidean'):
+        """
+        Returns the cost matrix pairwise_distances(X1, X2, metric=metric),
+        only computing it (and the parameters of the metric) if it is not in
+        the cache. Matrices loaded from the directory are read-only memory
+        maps, which are not counted in n_bytes.
+        """
+        key = self.key(X1, X2, metric)
+        if key in self.matrices:
+            self.matrices.move_to_end(key)
+            self.hits += 1
+            return self.matrices[key]
+        if key in self.mapped:
+            self.hits += 1
+            return self.mapped[key]
+        if self.directory is not None and os.path.exists(self.path(key)):
+            self.mapped[key] = np.load(self.path(key), mmap_mode='r')
+            self.hits += 1
+            return self.mapped[key]
+        M = pairwise_distances(X1, X2, metric=metric,
+                               **metric_params(X1, X2, metric))
+        self.misses += 1
+        if self.directory is not None:  # other processes may read it
+            temp_path = '{}.{}.tmp'.format(self.path(key), os.getpid())
+            with open(temp_path, 'wb') as out_file:
+                np.save(out_file, M)
+            os.replace(temp_path, self.path(key))
+        self.add(key, M)
+        return M
+
+    def clear(self):
+        """
+        Empties the cache in memory (the files in the directory are kept)
+        """
+        self.matrices.clear()
+        self.mapped.clear()
+        self.n_bytes = 0
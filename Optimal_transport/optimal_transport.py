@@ -8,19 +8,267 @@ michielfmstock@gmail.com
 General class for optimal transport
 """
 
-from sinkhorn_knopp import compute_optimal_transport
+from sinkhorn_knopp import compute_optimal_transport, compute_optimal_transport_log
+from sinkhorn_knopp import compute_optimal_transport_scaling
+from sinkhorn_knopp import compute_optimal_transport_parallel
+from sinkhorn_knopp import compute_optimal_transport_matrix_free
+from sinkhorn_knopp import compute_optimal_transport_sparse
 from sklearn.metrics.pairwise import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
+from sklearn.cluster import KMeans
 from sklearn.linear_model import RidgeCV
+from scipy.sparse import csr_matrix, issparse
+from collections import OrderedDict
 import numpy as np
 
+def metric_params(X1, X2, metric):
+    """
+    Parameters of the distance metric that depend on all points (the inverse
+    covariance for the Mahalanobis distance, as in pairwise_distances), such
+    that subsets of the points can be compared consistently
+    """
+    if metric == 'mahalanobis':
+        return {'VI' : np.linalg.inv(np.cov(np.vstack([X1, X2]).T))}
+    return {}
+
+def sparse_cost_matrix(X1, X2, n_neighbors=None, max_distance=None,
+                            metric='euclidean'):
+    """
+    Computes a sparse cost matrix only containing the relevant pairs: the
+    n_neighbors nearest neighbors of every point (in both directions) and/or
+    all pairs within max_distance. The nearest neighbor of every point is
+    always included, such that every row and column has at least one pair.
+
+    Inputs:
+        - X1, X2 : the two sets of points
+        - n_neighbors : number of nearest neighbors (default: None)
+        - max_distance : maximal distance of the pairs (default: None)
+        - metric : distance metric
+
+    Output:
+        - M : sparse cost matrix (scipy.sparse.csr_matrix)
+    """
+    params = metric_params(X1, X2, metric) or None
+    k = 1 if n_neighbors is None else n_neighbors
+    rows, cols, dists = [], [], []
+    for X_query, X_index, transpose in [(X1, X2, False), (X2, X1, True)]:
+        nn = NearestNeighbors(metric=metric, metric_params=params)
+        nn.fit(X_index)
+        graphs = [nn.kneighbors_graph(X_query, min(k, X_index.shape[0]),
+                                      mode='distance')]
+        if max_distance is not None and not transpose:
+            graphs.append(nn.radius_neighbors_graph(X_query, max_distance,
+                                                    mode='distance'))
+        for graph in graphs:
+            graph = graph.tocoo()
+            rows.append(graph.col if transpose else graph.row)
+            cols.append(graph.row if transpose else graph.col)
+            dists.append(graph.data)
+    rows, cols, dists = map(np.concatenate, (rows, cols, dists))
+    # remove the duplicate pairs (the key does not fit in 32 bits for large n)
+    _, unique = np.unique(rows.astype(np.int64) * X2.shape[0] + cols,
+                          return_index=True)
+    return csr_matrix((dists[unique], (rows[unique], cols[unique])),
+                      shape=(X1.shape[0], X2.shape[0]))
+
+def coarsen(X, w, n_clusters, random_state=None, branching=8):
+    """
+    Clusters weighted points in about n_clusters clusters using hierarchical
+    k-means: the points are split with k-means in at most branching clusters,
+    which are split again until they have less than 2 n / n_clusters points. As
+    every split only clusters the points of one cluster in a few groups, the
+    cost grows as n log(n) instead of n x n_clusters for a flat k-means.
+
+    Output:
+        - centers : weighted centroids of the clusters
+        - weights : total weight of every cluster
+        - labels : cluster of every point
+        - members : indices of the points of every cluster
+    """
+    n = X.shape[0]
+    size = int(np.ceil(n / float(n_clusters)))
+    labels = np.zeros(n, dtype=int)
+    n_labels = 0
+    to_split = [np.arange(n)]
+    while to_split:
+        indices = to_split.pop()
+        k = min(branching, len(indices) // size)
+        split = np.zeros(len(indices), dtype=int)
+        if k > 1:
+            kmeans = KMeans(k, n_init=1, random_state=random_state)
+            split = kmeans.fit_predict(X[indices], sample_weight=w[indices])
+        if np.all(split == split[0]):  # a leaf (or points that can not be split)
+            labels[indices] = n_labels
+            n_labels += 1
+        else:
+            to_split.extend(indices[split == j] for j in np.unique(split))
+    weights = np.bincount(labels, w)
+    centers = np.stack([np.bincount(labels, w * x) for x in X.T], 1)
+    centers /= weights.reshape((-1, 1))
+    members = np.split(np.argsort(labels, kind='stable'),
+                       np.cumsum(np.bincount(labels))[:-1])
+    return centers, weights, labels, members
+
+def compute_optimal_transport_multiscale(X1, X2, r, c, lam, epsilon=1e-5,
+                        distance_metric='euclidean', coarsening=10,
+                        coarsest_size=500, truncation=1e-5,
+                        random_state=None, return_potentials=False,
+                        **solver_options):
+    """
+    Computes the optimal transport matrix between two sets of points
+    coarse to fine. Both sets are clustered with k-means (coarsening points
+    per cluster), recursively until at most coarsest_size points are left,
+    which is solved densely in the log domain. At every finer level, only the
+    pairs of points of two clusters exchanging at least a fraction
+    truncation of the largest mass of their row or column in the coarse plan
+    are considered, starting from the coarse dual potentials. Building the
+    hierarchy costs n log(n) (see coarsen) and, as the coarse problems are
+    sparse as well, the Sinkhorn iterations scale with the number of
+    non-negligible entries of the plan instead of n x m. This number is only
+    linear in n if the plan of every point covers a fixed number of points,
+    i.e. if lam grows with the density of the points (with costs such as
+    'sqeuclidean' that give sharp plans). For a fixed lam, every point is
+    matched to a fixed region that contains more points as n grows, so the
+    cost remains quadratic, with a smaller constant. The result is
+    approximate: the clusters are compared by
+    their centroids, so some mass of the exact plan can fall outside the
+    refined pairs (decrease truncation to keep more pairs).
+
+    Inputs:
+        - X1, X2 : the two sets of points
+        - r, c : weights of the points
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - distance_metric : distance metric
+        - coarsening : average number of points per cluster
+        - coarsest_size : maximal number of points of the coarsest problem
+        - truncation : relative mass in the coarse plan for refining the
+                pairs of two clusters
+        - random_state : seed of the k-means clustering
+        - return_potentials : also return the dual potentials
+        - solver_options : other keyword arguments for the Sinkhorn-Knopp
+                algorithm of every level (max_iter, max_time, callback,
+                on_nan)
+
+    Output:
+        - P : sparse optimal transport matrix (n x m) (scipy.sparse.csr_matrix)
+        - M : sparse cost matrix with the pairs that were considered
+        - dist : Sinkhorn distance
+        - f, g : dual potentials (if return_potentials)
+        - diagnostics : SinkhornDiagnostics of the finest level
+    """
+    params = metric_params(X1, X2, distance_metric)
+    n, m = X1.shape[0], X2.shape[0]
+    if max(n, m) <= coarsest_size:
+        M = pairwise_distances(X1, X2, metric=distance_metric, **params)
+        P, dist, f, g, diagnostics = compute_optimal_transport_log(M, r, c,
+                                            lam, epsilon=epsilon,
+                                            lam_start=min(lam, 1 / M.max()),
+                                            return_potentials=True,
+                                            return_diagnostics=True,
+                                            **solver_options)
+        output = (csr_matrix(P), csr_matrix(M), dist)
+        if return_potentials:
+            output += (f, g)
+        return output + (diagnostics, )
+    # coarse problem
+    centers1, r_coarse, labels1, members1 = coarsen(X1, r,
+                        max(n // coarsening, 1), random_state)
+    centers2, c_coarse, labels2, members2 = coarsen(X2, c,
+                        max(m // coarsening, 1), random_state)
+    P_coarse, _, _, _, g_coarse, _ = compute_optimal_transport_multiscale(
+                        centers1, centers2, r_coarse, c_coarse, lam, epsilon,
+                        distance_metric, coarsening, coarsest_size,
+                        truncation, random_state, return_potentials=True,
+                        **solver_options)
+    # pairs of clusters to refine
+    P_coarse = P_coarse.tocoo()
+    a, b = P_coarse.row, P_coarse.col
+    row_max = np.zeros(len(r_coarse))
+    np.maximum.at(row_max, a, P_coarse.data)
+    col_max = np.zeros(len(c_coarse))
+    np.maximum.at(col_max, b, P_coarse.data)
+    keep = (P_coarse.data >= truncation * row_max[a]) |\
+            (P_coarse.data >= truncation * col_max[b])
+    refine = csr_matrix((np.ones(np.sum(keep)), (a[keep], b[keep])),
+                        shape=(len(r_coarse), len(c_coarse)))
+    rows, cols, dists = [], [], []
+    for a, members_a in enumerate(members1):  # refined pairs of a cluster
+        cols_a = np.concatenate([members2[b] for b in
+                        refine.indices[refine.indptr[a]:refine.indptr[a+1]]])
+        rows.append(np.repeat(members_a, len(cols_a)))
+        cols.append(np.tile(cols_a, len(members_a)))
+        dists.append(pairwise_distances(X1[members_a], X2[cols_a],
+                            metric=distance_metric, **params).ravel())
+    rows, cols, dists = map(np.concatenate, (rows, cols, dists))
+    M = csr_matrix((dists, (rows, cols)), shape=(n, m))
+    P, dist, f, g, diagnostics = compute_optimal_transport_sparse(M, r, c,
+                                        lam, epsilon=epsilon,
+                                        g=g_coarse[labels2],
+                                        return_potentials=True,
+                                        return_diagnostics=True,
+                                        **solver_options)
+    output = (P, M, dist)
+    if return_potentials:
+        output += (f, g)
+    return output + (diagnostics, )
+
+def scale_rows(P, w):
+    """
+    Multiplies every row of a (dense or sparse) matrix P by the weights w
+    """
+    if issparse(P):
+        return csr_matrix(P.multiply(w.reshape((-1, 1))))
+    return P * w.reshape((-1, 1))
+
 class OptimalTransport(object):
     """
     General class for optimal transport on a set of points with a given
     distance.
+
+    The transport matrix is computed using the standard Sinkhorn-Knopp
+    algorithm (method='standard'), its stabilized version in the log
+    domain (method='log'), which should be used for large values of lam, or
+    by only updating the scaling vectors (method='scaling'), which is faster
+    for large problems, optionally using a pool of threads
+    (method='parallel'). The SinkhornDiagnostics of the last run are kept in
+    self.diagnostics.
+
+    With method='sparse', only the pairs of nearest neighbors (n_neighbors)
+    and/or the pairs whose kernel value exp(-lam * M_ij) exceeds
+    kernel_threshold are considered, M and P are scipy sparse matrices. If
+    too few pairs are kept, the marginals can not be matched and the
+    iterations diverge (see self.diagnostics).
+
+    With method='multiscale', the problem is solved coarse to fine on a
+    k-means hierarchy of the points (see compute_optimal_transport_multiscale),
+    M is computed together with P and only contains the refined pairs.
+
+    The methods 'log', 'scaling' and 'sparse' keep the dual potentials
+    (self.f and self.g, with P_ij = exp(lam * (f_i + g_j - M_ij))) and start
+    from them when the problem is recomputed for a new value of lam or new
+    marginals. For method='scaling', the kernels of the last
+    kernel_cache_size values of lam are cached.
+
+    A CostMatrixCache (cost_cache) can be shared between objects over the
+    same points, such that the dense cost matrix is only computed once.
+
+    The dictionary solver_options is passed as keyword arguments to the
+    Sinkhorn-Knopp algorithm, e.g. {'max_iter' : 1000, 'max_time' : 10} to
+    limit its budget, or epsilon (default: 1e-6), callback and on_nan (see
+    sinkhorn_knopp.py).
     """
     def __init__(self, X1, X2, M=None, r=None, c=None, lam=10,
-                        fit_mapping=False, distance_metric='euclidean'):
+                        fit_mapping=False, distance_metric='euclidean',
+                        method='standard', n_neighbors=None,
+                        kernel_threshold=None, kernel_cache_size=2,
+                        cost_cache=None, solver_options=None):
         super(OptimalTransport, self).__init__()
+        assert method in ('standard', 'log', 'scaling', 'parallel', 'sparse',
+                          'multiscale')
+        assert method != 'multiscale' or M is None
+        self.method = method
+        self.distance_metric = distance_metric
         # check if all densities are nonzero
         assert (r is None or np.all(r>0)) and (c is None or np.all(c>0))
         self.X1 = X1
@@ -37,17 +285,47 @@ class OptimalTransport(object):
         else:
             self.c = c
         # compute the distance matrix
-        if M is None:  # compute distance matrix
-            self.M = pairwise_distances(X1, X2, metric=distance_metric)
+        if M is None and method == 'sparse':  # only the relevant pairs
+            max_distance = None
+            if kernel_threshold is not None:
+                max_distance = - np.log(kernel_threshold) / lam
+            self.M = sparse_cost_matrix(X1, X2, n_neighbors, max_distance,
+                                        metric=distance_metric)
+        elif method == 'multiscale':  # computed together with P
+            self.M = None
+        elif M is None and cost_cache is not None:  # computed only once
+            self.M = cost_cache.get(X1, X2, metric=distance_metric)
+        elif M is None:  # compute distance matrix
+            self.M = pairwise_distances(X1, X2, metric=distance_metric,
+                                **metric_params(X1, X2, distance_metric))
         else:
             self.M = M
+        self.f = None
+        self.g = None
+        self.kernels = OrderedDict()
+        self.kernel_cache_size = kernel_cache_size
+        self.solver_options = dict(solver_options or {})
         # compute the optimal transport mapping
         self.compute_optimal_transport(lam, fit_mapping)
         if fit_mapping:
             self.fit_mapping()
 
 
-    def compute_optimal_transport(self, lam, fit_mapping=False):
+    def kernel(self, lam):
+        """
+        Returns the kernel exp(-lam * M), cached for the last values of lam
+        """
+        if lam in self.kernels:
+            self.kernels.move_to_end(lam)
+        else:
+            self.kernels[lam] = np.exp(- lam * self.M)
+            if len(self.kernels) > self.kernel_cache_size:
+                self.kernels.popitem(last=False)
+        return self.kernels[lam]
+
+    def compute_optimal_transport(self, lam, fit_mapping=False, r=None,
+                                  c=None, warm_start=True,
+                                  solver_options=None):
         """
         (Re)computes the optimal transport matrix using the Skinkhorn-Knopp
         algorithm
@@ -55,10 +333,68 @@ class OptimalTransport(object):
         Inputs:
             - lam : the value of the entropic regularization
             - fit_mapping : fit the mappings from and to the distributions (default=False)
+            - r, c : new marginals (default: None, keep the current ones)
+            - warm_start : start from the dual potentials of the previous
+                    solution (default=True)
+            - solver_options : new keyword arguments for the Sinkhorn-Knopp
+                    algorithm (default: None, keep the current ones)
         """
-        self.P, self.d = compute_optimal_transport(
+        assert (r is None or np.all(r>0)) and (c is None or np.all(c>0))
+        if r is not None:
+            self.r = r
+        if c is not None:
+            self.c = c
+        self.lam = lam
+        if solver_options is not None:
+            self.solver_options = dict(solver_options)
+        options = dict({'epsilon' : 1e-6}, **self.solver_options)
+        if not warm_start:
+            self.f = None
+            self.g = None
+        if self.method == 'log':
+            self.P, self.d, self.f, self.g, self.diagnostics =\
+                    compute_optimal_transport_log(self.M,self.r, self.c,
+                                            lam, f=self.f,
+                                            g=self.g, return_potentials=True,
+                                            return_diagnostics=True,
+                                            **options)
+        elif self.method == 'scaling':
+            v = None
+            if self.g is not None:  # the potentials are defined up to a constant
+                v = np.exp(lam * (self.g - np.max(self.g)))
+            u, K, v, self.d, self.diagnostics =\
+                    compute_optimal_transport_scaling(self.M,self.r, self.c,
+                                            lam,
+                                            return_plan=False,
+                                            K=self.kernel(lam), v=v,
+                                            return_diagnostics=True,
+                                            **options)
+            self.P = u.reshape((-1, 1)) * K * v.reshape((1, -1))
+            with np.errstate(divide='ignore'):
+                self.f, self.g = np.log(u) / lam, np.log(v) / lam
+        elif self.method == 'sparse':
+            self.P, self.d, self.f, self.g, self.diagnostics =\
+                    compute_optimal_transport_sparse(self.M,self.r, self.c,
+                                            lam, g=self.g,
+                                            return_potentials=True,
+                                            return_diagnostics=True,
+                                            **options)
+        elif self.method == 'multiscale':
+            self.P, self.M, self.d, self.diagnostics =\
+                    compute_optimal_transport_multiscale(self.X1, self.X2,
+                                    self.r, self.c, lam,
+                                    distance_metric=self.distance_metric,
+                                    **options)
+        elif self.method == 'parallel':
+            self.P, self.d, self.diagnostics = compute_optimal_transport_parallel(
                                             self.M,self.r, self.c,
-                                            lam, epsilon=1e-6)
+                                            lam, return_diagnostics=True,
+                                            **options)
+        else:
+            self.P, self.d, self.diagnostics = compute_optimal_transport(
+                                            self.M,self.r, self.c,
+                                            lam, return_diagnostics=True,
+                                            **options)
         if fit_mapping:
             self.fit_mapping()
 
@@ -73,13 +409,12 @@ class OptimalTransport(object):
         P = self.P
         c = self.c
         r = self.r
-        reg_mapping = self.reg_mapping
-        # mapping from X1 to X2
+        # mapping from X1 to X2 (fitted on the barycentric mapping)
         self.model1to2 = RidgeCV(alphas=np.logspace(-3, 3, 7))
-        self.model1to2.fit(X1, (P * c.reshape((-1, 1))) @ X2)
+        self.model1to2.fit(X1, scale_rows(P, 1 / r) @ X2)
         # mapping from X2 to X1
         self.model2to1 = RidgeCV(alphas=np.logspace(-3, 3, 7))
-        self.model2to1.fit(X2, (P.T * r.reshape((-1, 1))) @ X2)
+        self.model2to1.fit(X2, scale_rows(P.T, 1 / c) @ X1)
 
     def interpolate(self, alpha):
         """
@@ -92,8 +427,7 @@ class OptimalTransport(object):
             - X : the interpolation between X1 and X2
             - w : weights of the points
         """
-        mixing = self.P.copy()
-        mixing /= self.r.reshape((-1, 1))
+        mixing = scale_rows(self.P, 1 / self.r)
         X = (1 - alpha) * self.X1 + alpha * mixing @ self.X2
         w = (1 - alpha) * self.r + alpha * mixing @ self.c
         return X, w
@@ -102,10 +436,150 @@ class OptimalTransport(object):
         """
         Map the first distribution to the second
         """
-        return model1to2.predict(X)
+        return self.model1to2.predict(X)
 
     def mapX2toX1(self, X):
         """
         Map the second distribution to the first
         """
-        return model2to1.predict(X)
+        return self.model2to1.predict(X)
+
+class TransportPlanOperator(object):
+    """
+    Transport matrix P_ij = exp(lam * (f_i + g_j - C_ij)) given by the dual
+    potentials, that is never stored but evaluated block by block from the
+    cost function.
+    """
+    def __init__(self, cost, f, g, lam, block_size=1000):
+        """
+        Inputs:
+            - cost : function returning the block C[rows, cols] of the cost
+                    matrix for two slices
+            - f, g : dual potentials (n, ) and (m, )
+            - lam : strength of the entropic regularization
+            - block_size : number of rows and columns per block
+        """
+        super(TransportPlanOperator, self).__init__()
+        self.cost = cost
+        self.f = f
+        self.g = g
+        self.lam = lam
+        self.block_size = block_size
+        self.shape = (len(f), len(g))
+
+    def blocks(self):
+        """
+        Generates the blocks (rows, cols, P[rows, cols]) of the transport
+        matrix
+        """
+        n, m = self.shape
+        for row_start in range(0, n, self.block_size):
+            rows = slice(row_start, min(row_start + self.block_size, n))
+            for col_start in range(0, m, self.block_size):
+                cols = slice(col_start, min(col_start + self.block_size, m))
+                yield rows, cols, np.exp(self.lam * (
+                                    self.f[rows].reshape((-1, 1)) +
+                                    self.g[cols].reshape((1, -1)) -
+                                    self.cost(rows, cols)))
+
+    def dot(self, Y):
+        """
+        Computes P @ Y for Y of shape (m, ) or (m, p)
+        """
+        result = np.zeros((self.shape[0], ) + Y.shape[1:])
+        for rows, cols, P_block in self.blocks():
+            result[rows] += P_block @ Y[cols]
+        return result
+
+    def T_dot(self, Z):
+        """
+        Computes P.T @ Z for Z of shape (n, ) or (n, p)
+        """
+        result = np.zeros((self.shape[1], ) + Z.shape[1:])
+        for rows, cols, P_block in self.blocks():
+            result[cols] += P_block.T @ Z[rows]
+        return result
+
+    def toarray(self):
+        """
+        Returns the dense transport matrix (only for small problems)
+        """
+        P = np.empty(self.shape)
+        for rows, cols, P_block in self.blocks():
+            P[rows, cols] = P_block
+        return P
+
+class MatrixFreeOptimalTransport(object):
+    """
+    Optimal transport on two sets of points that never stores the n x m cost
+    or transport matrix: the distances are recomputed block by block in every
+    Sinkhorn iteration, the transport matrix is only available as the
+    operator self.P (see TransportPlanOperator).
+    """
+    def __init__(self, X1, X2, r=None, c=None, lam=10,
+                        distance_metric='euclidean', block_size=1000):
+        super(MatrixFreeOptimalTransport, self).__init__()
+        # check if all densities are nonzero
+        assert (r is None or np.all(r>0)) and (c is None or np.all(c>0))
+        self.X1 = X1
+        n1, p1 = X1.shape
+        self.X2 = X2
+        n2, p2 = X2.shape
+        self.lam = lam
+        self.distance_metric = distance_metric
+        # computed once on all points, the same for every block
+        self.metric_params = metric_params(X1, X2, distance_metric)
+        self.block_size = block_size
+        self.r = np.ones(n1) / n1 if r is None else r
+        self.c = np.ones(n2) / n2 if c is None else c
+        self.f = None
+        self.g = None
+        self.compute_optimal_transport(lam)
+
+    def cost(self, rows, cols):
+        """
+        Computes the block M[rows, cols] of the cost matrix
+        """
+        return pairwise_distances(self.X1[rows], self.X2[cols],
+                                  metric=self.distance_metric,
+                                  **self.metric_params)
+
+    def compute_optimal_transport(self, lam):
+        """
+        (Re)computes the dual potentials using the Skinkhorn-Knopp algorithm,
+        starting from the previous potentials
+
+        Inputs:
+            - lam : the value of the entropic regularization
+        """
+        self.lam = lam
+        self.f, self.g, self.d, self.diagnostics =\
+                compute_optimal_transport_matrix_free(self.cost, self.r,
+                                        self.c, lam, epsilon=1e-6,
+                                        block_size=self.block_size,
+                                        f=self.f, g=self.g,
+                                        return_diagnostics=True)
+        self.P = TransportPlanOperator(self.cost, self.f, self.g, lam,
+                                       self.block_size)
+
+    def barycentric_map(self):
+        """
+        Maps every point of X1 to the weighted average of the points of X2 it
+        is transported to
+        """
+        return self.P.dot(self.X2) / self.r.reshape((-1, 1))
+
+    def interpolate(self, alpha):
+        """
+        Interpolate between the two distributions.
+
+        Input:
+            - alpha : value between 0 and 1 for the interpolation
+
+        Output:
+            - X : the interpolation between X1 and X2
+            - w : weights of the points
+        """
+        X = (1 - alpha) * self.X1 + alpha * self.barycentric_map()
+        w = (1 - alpha) * self.r + alpha * self.P.dot(self.c) / self.r
+        return X, w
@@ -9,8 +9,103 @@ Implementation of the Sinkhorn-Knopp algorithm for optimal transport
 """
 
 import numpy as np
+from scipy.special import logsumexp
+from scipy.sparse import csr_matrix
+from itertools import count
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+import warnings
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
 
-def compute_optimal_transport(M, r, c, lam, epsilon=1e-5):
+@contextmanager
+def blas_limits(n_threads):
+    """
+    Limits the number of threads used by BLAS (if threadpoolctl is installed)
+    """
+    if threadpool_limits is None:
+        yield
+    else:
+        with threadpool_limits(limits=n_threads, user_api='blas'):
+            yield
+
+class SinkhornDiagnostics(object):
+    """
+    Keeps track of a run of the Sinkhorn-Knopp algorithm: the convergence
+    error and the elapsed time at every check, the number of iterations,
+    whether it converged and, if not, why it stopped.
+    """
+    def __init__(self, epsilon, max_time=None, callback=None, on_nan='warn'):
+        """
+        Inputs:
+            - epsilon : convergence parameter
+            - max_time : time budget in seconds (default: None)
+            - callback : function called with the diagnostics at every check,
+                    the algorithm stops if it returns True (default: None)
+            - on_nan : 'warn' or 'raise' when NaN or infinite values or an
+                    underflowing kernel are encountered (default: 'warn')
+        """
+        super(SinkhornDiagnostics, self).__init__()
+        assert on_nan in ('warn', 'raise')
+        self.epsilon = epsilon
+        self.max_time = max_time
+        self.callback = callback
+        self.on_nan = on_nan
+        self.n_iter = 0
+        self.errors = []
+        self.times = []
+        self.converged = False
+        self.interrupted = False
+        self.lam = None  # set by solvers that change lam (epsilon-scaling)
+        self.message = 'maximum number of iterations reached'
+        self._start = time()
+
+    @property
+    def elapsed(self):
+        return time() - self._start
+
+    def fail(self, message):
+        """
+        Warns or raises for numerical problems
+        """
+        self.converged = False
+        self.interrupted = True
+        self.message = message
+        if self.on_nan == 'raise':
+            raise FloatingPointError(message)
+        warnings.warn(message, RuntimeWarning)
+
+    def stop(self, error, n_iter):
+        """
+        Records the error after n_iter iterations and decides whether the
+        algorithm should stop
+        """
+        self.n_iter = n_iter
+        self.errors.append(error)
+        self.times.append(self.elapsed)
+        self.converged = error <= self.epsilon
+        self.message = 'maximum number of iterations reached'
+        if self.converged:
+            self.message = 'converged'
+        elif not np.isfinite(error):
+            self.fail('NaN or infinite values after {} iterations, lam is '
+                      'probably too large (use '
+                      'compute_optimal_transport_log)'.format(n_iter))
+        elif self.callback is not None and self.callback(self):
+            self.interrupted = True
+            self.message = 'stopped by callback'
+        elif self.max_time is not None and self.times[-1] > self.max_time:
+            self.interrupted = True
+            self.message = 'time budget exceeded'
+        return self.converged or self.interrupted
+
+def compute_optimal_transport(M, r, c, lam, epsilon=1e-5, max_iter=None,
+                              max_time=None, callback=None, on_nan='warn',
+                              return_diagnostics=False):
     """
     Computes the optimal transport matrix and Slinkhorn distance using the
     Sinkhorn-Knopp algorithm
@@ -21,22 +116,491 @@ def compute_optimal_transport(M, r, c, lam, epsilon=1e-5):
         - c : vector of marginals (m, )
         - lam : strength of the entropic regularization
         - epsilon : convergence parameter
+        - max_iter : maximal number of iterations (default: None, no limit)
+        - max_time : time budget in seconds (default: None, no limit)
+        - callback : function called with the SinkhornDiagnostics after
+                every iteration, stops the algorithm if it returns True
+        - on_nan : 'warn' or 'raise' on NaN values or underflow
+        - return_diagnostics : also return the SinkhornDiagnostics
 
     Output:
         - P : optimal transport matrix (n x m)
         - dist : Sinkhorn distance
+        - diagnostics : SinkhornDiagnostics (if return_diagnostics)
     """
+    diagnostics = SinkhornDiagnostics(epsilon, max_time, callback, on_nan)
     n, m = M.shape
     P = np.exp(- lam * M)
-    P /= P.sum()
-    u = np.zeros(n)
-    # normalize this matrix
-    while np.max(np.abs(u - P.sum(1))) > epsilon:
-        u = P.sum(1)
-        P *= (r / u).reshape((-1, 1))
-        P *= (c / P.sum(0)).reshape((1, -1))
+    if not P.sum() > 0:
+        diagnostics.fail('the kernel exp(- lam * M) underflows, lam is too '
+                         'large (use compute_optimal_transport_log)')
+    else:
+        P /= P.sum()
+        # normalize this matrix
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for iteration in (count() if max_iter is None
+                                      else range(max_iter)):
+                u = P.sum(1)
+                P *= (r / u).reshape((-1, 1))
+                P *= (c / P.sum(0)).reshape((1, -1))
+                if diagnostics.stop(np.max(np.abs(u - P.sum(1))),
+                                    iteration + 1):
+                    break
+    if return_diagnostics:
+        return P, np.sum(P * M), diagnostics
     return P, np.sum(P * M)
 
+def compute_optimal_transport_log(M, r, c, lam, epsilon=1e-5, max_iter=1000,
+                                  lam_start=None, n_annealing=5, f=None,
+                                  g=None, return_potentials=False,
+                                  max_time=None, callback=None, on_nan='warn',
+                                  return_diagnostics=False):
+    """
+    Computes the optimal transport matrix and Slinkhorn distance using the
+    Sinkhorn-Knopp algorithm in the log domain. Instead of the (possibly
+    underflowing) kernel exp(-lam * M), the dual potentials f and g are
+    updated, with P_ij = exp(lam * (f_i + g_j - M_ij)). This is stable for
+    large values of lam.
+
+    Optionally uses epsilon-scaling: the problem is solved for increasing
+    values of lam (from lam_start to lam), each warm-started from the
+    potentials of the previous one. If the algorithm is stopped before the
+    last value of lam, the plan and the distance are computed with the value
+    of lam the potentials belong to (diagnostics.lam).
+
+    Inputs:
+        - M : cost matrix (n x m)
+        - r : vector of marginals (n, )
+        - c : vector of marginals (m, )
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - max_iter : maximal number of iterations for each value of lam
+        - lam_start : initial value of lam for epsilon-scaling (default: None,
+                no epsilon-scaling)
+        - n_annealing : number of values of lam used for epsilon-scaling
+        - f, g : initial dual potentials (n, ) and (m, ) (default: zeros)
+        - return_potentials : also return the dual potentials
+        - max_time, callback, on_nan, return_diagnostics : see
+                compute_optimal_transport
+
+    Output:
+        - P : optimal transport matrix (n x m)
+        - dist : Sinkhorn distance
+        - f, g : dual potentials (if return_potentials)
+        - diagnostics : SinkhornDiagnostics (if return_diagnostics)
+    """
+    diagnostics = SinkhornDiagnostics(epsilon, max_time, callback, on_nan)
+    n_iter = 0
+    n, m = M.shape
+    log_r = np.log(r)
+    log_c = np.log(c)
+    f = np.zeros(n) if f is None else f.copy()
+    g = np.zeros(m) if g is None else g.copy()
+    if lam_start is None:
+        lams = [lam]
+    else:
+        lams = np.geomspace(lam_start, lam, n_annealing)
+    for lam_k in lams:
+        lse_g = logsumexp(lam_k * (g.reshape((1, -1)) - M), axis=1)
+        for iteration in range(max_iter):
+            f = (log_r - lse_g) / lam_k
+            g = (log_c - logsumexp(lam_k * (f.reshape((-1, 1)) - M),
+                                   axis=0)) / lam_k
+            lse_g = logsumexp(lam_k * (g.reshape((1, -1)) - M), axis=1)
+            n_iter += 1
+            # columns are exact, check the rows
+            if diagnostics.stop(np.max(np.abs(np.exp(lam_k * f + lse_g) - r)),
+                                n_iter):
+                break
+        if diagnostics.interrupted:
+            break
+    diagnostics.lam = lam_k
+    P = np.exp(lam_k * (f.reshape((-1, 1)) + g.reshape((1, -1)) - M))
+    output = (P, np.sum(P * M))
+    if return_potentials:
+        output += (f, g)
+    if return_diagnostics:
+        output += (diagnostics, )
+    return output
+
+def compute_optimal_transport_scaling(M, r, c, lam, epsilon=1e-5,
+                                      max_iter=10000, check_every=10,
+                                      return_plan=True, K=None, v=None,
+                                      max_time=None, callback=None,
+                                      on_nan='warn', return_diagnostics=False):
+    """
+    Computes the optimal transport matrix and Slinkhorn distance using the
+    Sinkhorn-Knopp algorithm, iterating only on the scaling vectors u and v
+    with P = diag(u) K diag(v) and K = exp(-lam * M) the fixed Gibbs kernel.
+    Every iteration costs two matrix-vector products, the convergence is only
+    checked every check_every iterations.
+
+    Inputs:
+        - M : cost matrix (n x m)
+        - r : vector of marginals (n, )
+        - c : vector of marginals (m, )
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - max_iter : maximal number of iterations
+        - check_every : number of iterations between convergence checks
+        - return_plan : return P, otherwise return the scaling vectors and
+                the kernel
+        - K : precomputed kernel exp(-lam * M) (default: None, computed)
+        - v : initial scaling vector (m, ), e.g. from a previous solution
+                (default: ones)
+        - max_time, callback, on_nan, return_diagnostics : see
+                compute_optimal_transport (only evaluated at the checks)
+
+    Output:
+        - P : optimal transport matrix (n x m) (if return_plan)
+        - u, K, v : scaling vectors and kernel (if not return_plan)
+        - dist : Sinkhorn distance
+        - diagnostics : SinkhornDiagnostics (if return_diagnostics)
+    """
+    diagnostics = SinkhornDiagnostics(epsilon, max_time, callback, on_nan)
+    n, m = M.shape
+    if K is None:
+        K = np.exp(- lam * M)
+    if not np.all(K.sum(1) > 0):
+        diagnostics.fail('the kernel exp(- lam * M) underflows, lam is too '
+                         'large (use compute_optimal_transport_log)')
+    v = np.ones(m) if v is None else v
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for iteration in range(max_iter):
+            u = r / (K @ v)
+            v = c / (K.T @ u)
+            # columns are exact, check the rows
+            if ((iteration + 1) % check_every == 0 or\
+                    iteration + 1 == max_iter) and\
+                    diagnostics.stop(np.max(np.abs(u * (K @ v) - r)),
+                                     iteration + 1):
+                break
+    # sum_ij u_i K_ij M_ij v_j without forming P
+    dist = u @ np.einsum('ij,ij,j->i', K, M, v)
+    if return_plan:
+        output = (u.reshape((-1, 1)) * K * v.reshape((1, -1)), dist)
+    else:
+        output = (u, K, v, dist)
+    if return_diagnostics:
+        output += (diagnostics, )
+    return output
+
+def compute_optimal_transport_batch(M, R, C, lam, epsilon=1e-5,
+                                    max_iter=10000, check_every=10,
+                                    return_plans=False):
+    """
+    Computes the optimal transport matrices and Slinkhorn distances for many
+    pairs of marginals sharing the same cost matrix. The scaling vectors of
+    all pairs are updated simultaneously using matrix-matrix products, pairs
+    that have converged are no longer updated.
+
+    Inputs:
+        - M : cost matrix (n x m)
+        - R : marginals (n_pairs x n)
+        - C : marginals (n_pairs x m)
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - max_iter : maximal number of iterations
+        - check_every : number of iterations between convergence checks
+        - return_plans : also return the transport matrices
+
+    Output:
+        - P : optimal transport matrices (n_pairs x n x m) (if return_plans)
+        - dists : Sinkhorn distances (n_pairs, )
+        - converged : boolean indicating for every pair whether it converged
+    """
+    n, m = M.shape
+    R = np.asarray(R, dtype=float).T
+    C = np.asarray(C, dtype=float).T
+    n_pairs = R.shape[1]
+    K = np.exp(- lam * M)
+    U = np.ones((n, n_pairs))
+    V = np.ones((m, n_pairs))
+    converged = np.zeros(n_pairs, dtype=bool)
+    active = np.arange(n_pairs)
+    for iteration in range(max_iter):
+        U[:, active] = R[:, active] / (K @ V[:, active])
+        V[:, active] = C[:, active] / (K.T @ U[:, active])
+        if (iteration + 1) % check_every == 0:
+            # columns are exact, check the rows
+            errors = np.max(np.abs(U[:, active] * (K @ V[:, active])
+                                   - R[:, active]), axis=0)
+            converged[active[errors <= epsilon]] = True
+            active = active[errors > epsilon]
+            if len(active) == 0:
+                break
+    dists = np.sum(U * ((K * M) @ V), axis=0)
+    if return_plans:
+        P = U.T[:, :, None] * K[None, :, :] * V.T[:, None, :]
+        return P, dists, converged
+    return dists, converged
+
+def compute_optimal_transport_parallel(M, r, c, lam, epsilon=1e-5,
+                                       max_iter=10000, check_every=10,
+                                       n_jobs=None, block_size=None,
+                                       max_time=None, callback=None,
+                                       on_nan='warn',
+                                       return_diagnostics=False):
+    """
+    Computes the optimal transport matrix and Slinkhorn distance using the
+    scaling vector updates of compute_optimal_transport_scaling, with the
+    rows of the problem partitioned in blocks that are processed by a pool of
+    threads. The threads share M and the kernel (no copies), the products
+    with the transposed kernel are reduced over the blocks. BLAS is limited
+    to one thread per block (if threadpoolctl is installed) to avoid
+    oversubscription.
+
+    Inputs:
+        - M : cost matrix (n x m)
+        - r : vector of marginals (n, )
+        - c : vector of marginals (m, )
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - max_iter : maximal number of iterations
+        - check_every : number of iterations between convergence checks
+        - n_jobs : number of threads (default: number of cpus)
+        - block_size : number of rows per block (default: n / n_jobs)
+        - max_time, callback, on_nan, return_diagnostics : see
+                compute_optimal_transport (only evaluated at the checks)
+
+    Output:
+        - P : optimal transport matrix (n x m)
+        - dist : Sinkhorn distance
+        - diagnostics : SinkhornDiagnostics (if return_diagnostics)
+    """
+    diagnostics = SinkhornDiagnostics(epsilon, max_time, callback, on_nan)
+    n, m = M.shape
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    if block_size is None:
+        block_size = int(np.ceil(n / n_jobs))
+    blocks = [slice(start, min(start + block_size, n))
+              for start in range(0, n, block_size)]
+    K = np.empty((n, m))
+    u = np.empty(n)
+    v = np.ones(m)
+
+    def compute_kernel(block):
+        np.multiply(M[block], - lam, out=K[block])
+        np.exp(K[block], out=K[block])
+
+    def update_u(block):
+        u[block] = r[block] / (K[block] @ v)
+        return K[block].T @ u[block]
+
+    def row_error(block):
+        return np.max(np.abs(u[block] * (K[block] @ v) - r[block]))
+
+    def block_dist(block):
+        return u[block] @ np.einsum('ij,ij,j->i', K[block], M[block], v)
+
+    def compute_plan(block):
+        K[block] *= u[block].reshape((-1, 1))
+        K[block] *= v.reshape((1, -1))
+
+    with ThreadPoolExecutor(n_jobs) as pool, blas_limits(1),\
+            np.errstate(divide='ignore', invalid='ignore'):
+        list(pool.map(compute_kernel, blocks))
+        if not np.all(np.isfinite(K)) or\
+                not all(pool.map(lambda block : np.all(K[block].sum(1) > 0),
+                                 blocks)):
+            diagnostics.fail('the kernel exp(- lam * M) underflows, lam is '
+                             'too large (use compute_optimal_transport_log)')
+        for iteration in range(max_iter):
+            v = c / sum(pool.map(update_u, blocks))
+            if ((iteration + 1) % check_every == 0 or\
+                    iteration + 1 == max_iter) and\
+                    diagnostics.stop(max(pool.map(row_error, blocks)),
+                                     iteration + 1):
+                break
+        dist = sum(pool.map(block_dist, blocks))
+        list(pool.map(compute_plan, blocks))
+    if return_diagnostics:
+        return K, dist, diagnostics
+    return K, dist
+
+def block_logsumexp(cost, potential, lam, shape, block_size=1000):
+    """
+    Computes logsumexp_j(lam * (potential_j - C_ij)) for every row i of a
+    cost matrix C that is only evaluated block by block, using an online
+    log-sum-exp reduction over the blocks of columns.
+
+    Inputs:
+        - cost : function returning the block C[rows, cols] for two slices
+        - potential : vector (m, )
+        - lam : strength of the entropic regularization
+        - shape : shape (n, m) of the cost matrix
+        - block_size : number of rows and columns per block
+
+    Output:
+        - vector (n, )
+    """
+    n, m = shape
+    result = np.empty(n)
+    for row_start in range(0, n, block_size):
+        rows = slice(row_start, min(row_start + block_size, n))
+        lse = np.full(rows.stop - rows.start, - np.inf)
+        for col_start in range(0, m, block_size):
+            cols = slice(col_start, min(col_start + block_size, m))
+            lse = np.logaddexp(lse, logsumexp(lam * (potential[cols]
+                                    .reshape((1, -1)) - cost(rows, cols)),
+                                    axis=1))
+        result[rows] = lse
+    return result
+
+def compute_optimal_transport_matrix_free(cost, r, c, lam, epsilon=1e-5,
+                                          max_iter=1000, block_size=1000,
+                                          f=None, g=None, max_time=None,
+                                          callback=None, on_nan='warn',
+                                          return_diagnostics=False):
+    """
+    Computes the dual potentials of the optimal transport problem using the
+    Sinkhorn-Knopp algorithm in the log domain, without ever storing the
+    cost matrix or the transport matrix: the cost is recomputed block by
+    block in every iteration. The transport matrix is given by
+    P_ij = exp(lam * (f_i + g_j - C_ij)).
+
+    Inputs:
+        - cost : function returning the block C[rows, cols] for two slices
+        - r : vector of marginals (n, )
+        - c : vector of marginals (m, )
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - max_iter : maximal number of iterations
+        - block_size : number of rows and columns per block
+        - f, g : initial dual potentials (n, ) and (m, ) (default: zeros)
+        - max_time, callback, on_nan, return_diagnostics : see
+                compute_optimal_transport
+
+    Output:
+        - f, g : dual potentials
+        - dist : Sinkhorn distance
+        - diagnostics : SinkhornDiagnostics (if return_diagnostics)
+    """
+    diagnostics = SinkhornDiagnostics(epsilon, max_time, callback, on_nan)
+    n, m = len(r), len(c)
+    cost_T = lambda cols, rows : cost(rows, cols).T
+    log_r = np.log(r)
+    log_c = np.log(c)
+    f = np.zeros(n) if f is None else f.copy()
+    g = np.zeros(m) if g is None else g.copy()
+    lse_g = block_logsumexp(cost, g, lam, (n, m), block_size)
+    for iteration in range(max_iter):
+        f = (log_r - lse_g) / lam
+        g = (log_c - block_logsumexp(cost_T, f, lam, (m, n),
+                                     block_size)) / lam
+        lse_g = block_logsumexp(cost, g, lam, (n, m), block_size)
+        # columns are exact, check the rows
+        if diagnostics.stop(np.max(np.abs(np.exp(lam * f + lse_g) - r)),
+                            iteration + 1):
+            break
+    dist = 0.0
+    for row_start in range(0, n, block_size):
+        rows = slice(row_start, min(row_start + block_size, n))
+        for col_start in range(0, m, block_size):
+            cols = slice(col_start, min(col_start + block_size, m))
+            C = cost(rows, cols)
+            dist += np.sum(np.exp(lam * (f[rows].reshape((-1, 1)) +
+                                         g[cols].reshape((1, -1)) - C)) * C)
+    if return_diagnostics:
+        return f, g, dist, diagnostics
+    return f, g, dist
+
+def compute_optimal_transport_sparse(M, r, c, lam, epsilon=1e-5,
+                                     max_iter=10000, check_every=10, g=None,
+                                     return_potentials=False, max_time=None,
+                                     callback=None, on_nan='warn',
+                                     return_diagnostics=False):
+    """
+    Computes a sparse optimal transport matrix and Slinkhorn distance using
+    the scaling vector updates of compute_optimal_transport_scaling, where
+    only the pairs stored in the sparse cost matrix M can be matched (all
+    other entries of the kernel are assumed to be zero). To avoid underflow,
+    the costs of every row and column are shifted, such that its largest
+    kernel entry is one, an initial potential g is absorbed in the kernel as
+    well. Whenever a scaling vector becomes too
+    large or too small (for large values of lam), it is absorbed in the
+    potentials and the kernel is recomputed, such that u and v stay close to
+    one. The plan is computed from the potentials in the log domain. If the
+    pairs in M can not match the marginals, the iterations do not converge
+    (see the diagnostics); a plan or distance that is not finite is reported
+    as a failure.
+
+    Inputs:
+        - M : sparse cost matrix (n x m) (scipy.sparse), explicitly stored
+                zeros are pairs with zero cost (a dense M is converted, so
+                its zeros are dropped)
+        - r : vector of marginals (n, )
+        - c : vector of marginals (m, )
+        - lam : strength of the entropic regularization
+        - epsilon : convergence parameter
+        - max_iter : maximal number of iterations
+        - check_every : number of iterations between convergence checks
+        - g : initial dual potential of the columns (m, ), e.g. from a coarser
+                problem (default: zeros)
+        - return_potentials : also return the dual potentials
+        - max_time, callback, on_nan, return_diagnostics : see
+                compute_optimal_transport (only evaluated at the checks)
+
+    Output:
+        - P : sparse optimal transport matrix (n x m) (scipy.sparse.csr_matrix)
+        - dist : Sinkhorn distance
+        - f, g : dual potentials, P_ij = exp(lam * (f_i + g_j - M_ij)) (if
+                return_potentials)
+        - diagnostics : SinkhornDiagnostics (if return_diagnostics)
+    """
+    diagnostics = SinkhornDiagnostics(epsilon, max_time, callback, on_nan)
+    M = csr_matrix(M)
+    M.sum_duplicates()
+    n, m = M.shape
+    row_lengths = np.diff(M.indptr)
+    if np.any(row_lengths == 0) or\
+            np.any(np.bincount(M.indices, minlength=m) == 0):
+        raise ValueError('every row and column of M needs at least one pair')
+    rows = np.repeat(np.arange(n), row_lengths)
+    if g is None:
+        g = np.zeros(m)
+    # potentials absorbed in the kernel K_ij = exp(lam * (f_i + g_j - M_ij))
+    f = np.minimum.reduceat(M.data - g[M.indices], M.indptr[:-1])
+    # every row and column gets an entry exp(0) = 1 in the kernel
+    col_max = np.full(m, -np.inf)
+    np.maximum.at(col_max, M.indices, f[rows] + g[M.indices] - M.data)
+    g = g - col_max
+    K = M.copy()
+    K.data = np.exp(lam * (f[rows] + g[M.indices] - M.data))
+    u = np.ones(n)
+    v = np.ones(m)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for iteration in range(max_iter):
+            u = r / (K @ v)
+            v = c / (K.T @ u)
+            # columns are exact, check the rows
+            if ((iteration + 1) % check_every == 0 or\
+                    iteration + 1 == max_iter) and\
+                    diagnostics.stop(np.max(np.abs(u * (K @ v) - r)),
+                                     iteration + 1):
+                break
+            if max(np.max(u), np.max(v), 1 / np.min(u), 1 / np.min(v)) > 1e50:
+                f += np.log(u) / lam
+                g += np.log(v) / lam
+                K.data = np.exp(lam * (f[rows] + g[M.indices] - M.data))
+                u = np.ones(n)
+                v = np.ones(m)
+        f += np.log(u) / lam
+        g += np.log(v) / lam
+        P = K
+        P.data = np.exp(lam * (f[rows] + g[P.indices] - M.data))
+        dist = np.sum(P.data * M.data)
+    if not (np.all(np.isfinite(P.data)) and np.isfinite(dist)):
+        diagnostics.fail('the sparse transport plan is not finite, M has '
+                         'too few pairs or lam is too large')
+    output = (P, dist)
+    if return_potentials:
+        output += (f, g)
+    if return_diagnostics:
+        output += (diagnostics, )
+    return output
+
 
 if __name__ == '__main__':
 
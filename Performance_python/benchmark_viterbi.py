@@ -0,0 +1,188 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Benchmark of the different implementations of the Viterbi algorithm
+
+Sweeps the length of the sequence and the number of states of a random HMM.
+For every variant, the first call (including the JIT compilation) is timed
+separately on a short sequence, next the steady-state run time and the peak
+memory (of the allocations traced by tracemalloc, i.e. not those made inside
+compiled numba code) are recorded and the decoded path is compared with the
+reference implementation. Set-up that can be reused between decodings (the
+HMM object of hmm.py) is done once for every model, outside of the timed
+runs. The results are written as JSON.
+
+Usage:
+    python benchmark_viterbi.py --lengths 100 1000 --states 2 10 -o out.json
+"""
+
+import numpy as np
+import argparse
+import json
+import tracemalloc
+from importlib import import_module
+from time import time
+
+REFERENCE = 'vectorized'
+
+def get_variants():
+    '''
+    Returns a dictionary with the name and the decoding function of all
+    variants, each called as f(seq_int, emission_probs, transition_probs,
+    starting_probs)
+    '''
+    variants = {}
+    for name in ['viterbi', 'viterbi_cleaned', 'viterbi_numba',
+                 'viterbi_numba2', 'viterbi_numba3', 'viterbi_numba4',
+                 'viterbi_vectorized', 'viterbi_memory', 'viterbi_sparse',
+                 'viterbi_parallel']:
+        short_name = name.replace('viterbi_', '').replace('viterbi', 'loops')
+        variants[short_name] = import_module(name).viterbi
+    variants['memory_checkpoint'] = lambda *model : variants['memory'](*model,
+                                        checkpoint_every='sqrt')
+    HMM = import_module('hmm').HMM
+    hmms = {}
+    def decode_hmm(seq_int, *model):
+        # the HMM is built once for every model, such that only the decoding
+        # is timed (the model is kept, so its id is not reused)
+        key = tuple(id(params) for params in model)
+        if key not in hmms:
+            hmms[key] = (HMM(*model), model)
+        return hmms[key][0].viterbi(seq_int)
+    variants['hmm'] = decode_hmm
+    return variants
+
+def random_hmm(n_states, n_symbols, random_state):
+    '''
+    Generates the parameters of a random HMM
+    '''
+    emission_probs = random_state.dirichlet(np.ones(n_symbols), n_states).T
+    transition_probs = random_state.dirichlet(np.ones(n_states), n_states)
+    starting_probs = random_state.dirichlet(np.ones(n_states))
+    return emission_probs, transition_probs, starting_probs
+
+def run_variant(decode, seq_int, model, n_repeats):
+    '''
+    Times a variant and measures its peak memory
+    OUTPUT:
+        - path, list of run times, peak memory (bytes)
+    '''
+    run_times = []
+    for _ in range(n_repeats):
+        t0 = time()
+        path = decode(seq_int, *model)
+        run_times.append(time() - t0)
+    tracemalloc.start()
+    decode(seq_int, *model)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.asarray(path), run_times, peak_memory
+
+def benchmark(variants, lengths, n_states_list, n_symbols=4, n_repeats=3,
+        max_time=10.0, seed=0):
+    '''
+    Runs the benchmark
+    INPUTS:
+        - variants: dictionary with the variants
+        - lengths: list of lengths of the sequences
+        - n_states_list: list of numbers of states
+        - n_symbols: number of symbols (default: 4)
+        - n_repeats: number of timed runs (default: 3)
+        - max_time: a variant is skipped for larger problems once a single
+                run takes longer than this (in seconds, default: 10)
+        - seed: seed of the random number generator (default: 0)
+    OUTPUT:
+        - list of dictionaries, one for every variant and problem size
+    '''
+    random_state = np.random.RandomState(seed)
+    results = []
+    too_slow = {}
+    compiled = set()
+    prepared = set()
+    for n_states in n_states_list:
+        model = random_hmm(n_states, n_symbols, random_state)
+        for length_seq in lengths:
+            seq_int = random_state.randint(0, n_symbols, length_seq)
+            reference_path = np.asarray(variants[REFERENCE](seq_int, *model))
+            for name, decode in sorted(variants.items()):
+                result = {'variant' : name, 'length' : length_seq,
+                          'n_states' : n_states, 'n_symbols' : n_symbols}
+                results.append(result)
+                if too_slow.get(name, np.inf) <= n_states**2 * length_seq:
+                    result['status'] = 'skipped'
+                    continue
+                try:
+                    if name not in compiled:
+                        # first call, includes the JIT compilation
+                        t0 = time()
+                        decode(seq_int[:10], *model)
+                        result['first_call_time'] = time() - t0
+                        compiled.add(name)
+                    elif (name, n_states) not in prepared:
+                        # not timed, sets up the variant for a new model
+                        decode(seq_int[:10], *model)
+                    prepared.add((name, n_states))
+                    path, run_times, peak_memory = run_variant(decode,
+                            seq_int, model, n_repeats)
+                except Exception as error:
+                    result['status'] = 'error'
+                    result['error'] = '{}: {}'.format(type(error).__name__,
+                                                      error)
+                    continue
+                result['status'] = 'ok'
+                result['min_time'] = min(run_times)
+                result['median_time'] = float(np.median(run_times))
+                result['peak_memory'] = peak_memory
+                result['same_path'] = bool(len(path) == len(reference_path)
+                                        and np.all(path == reference_path))
+                if max(run_times) > max_time:
+                    too_slow[name] = n_states**2 * length_seq
+    return results
+
+
+
+if __name__=='__main__':
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--lengths', type=int, nargs='+',
+                default=[100, 1000, 10000],
+                help='lengths of the sequences (default: 100 1000 10000)')
+    arg_parser.add_argument('--states', type=int, nargs='+',
+                default=[2, 10, 50],
+                help='numbers of states (default: 2 10 50)')
+    arg_parser.add_argument('--symbols', type=int, default=4,
+                help='number of symbols (default: 4)')
+    arg_parser.add_argument('--repeats', type=int, default=3,
+                help='number of timed runs (default: 3)')
+    arg_parser.add_argument('--max_time', type=float, default=10.0,
+                help='skip a variant for larger problems once a run takes '
+                     'longer than this (seconds, default: 10)')
+    arg_parser.add_argument('--variants', type=str, nargs='+', default=None,
+                help='only run these variants (default: all)')
+    arg_parser.add_argument('--seed', type=int, default=0,
+                help='seed for the random models (default: 0)')
+    arg_parser.add_argument('-o', '--out', type=str,
+                default='benchmark_viterbi.json',
+                help='name of the output file (default: benchmark_viterbi.json)')
+    args = arg_parser.parse_args()
+
+    variants = get_variants()
+    if args.variants is not None:
+        variants = dict((name, variants[name]) for name in
+                        set(args.variants) | set([REFERENCE]))
+    results = benchmark(variants, args.lengths, args.states, args.symbols,
+                        args.repeats, args.max_time, args.seed)
+    with open(args.out, 'w') as out_file:
+        json.dump(results, out_file, indent=2)
+    for result in results:
+        if result['status'] == 'ok':
+            print('{variant:>18} L={length:<8} n={n_states:<4} '
+                  '{median_time:10.5f}s {peak_memory:>12}B same path: '
+                  '{same_path}'.format(**result))
+        else:
+            print('{variant:>18} L={length:<8} n={n_states:<4} '
+                  '{status}'.format(**result))
@@ -0,0 +1,246 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Forward-backward algorithm, posterior decoding and Baum-Welch training of a
+HMM
+
+The forward and backward variables are scaled at every position (the scaling
+factors give the log-likelihood), so no logarithms are needed in the inner
+loops. The sufficient statistics of the Baum-Welch algorithm can be
+accumulated over the sequences in parallel worker processes.
+"""
+
+import numpy as np
+from numba import jit
+from multiprocessing import Pool
+
+@jit
+def forward(seq_int, emission_probs, transition_probs, starting_probs):
+    '''
+    Scaled forward algorithm
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+    OUTPUT:
+        - alpha: scaled forward variables (n_states x length_seq), every
+                column sums to one
+        - scales: the scaling factors, the log-likelihood of the sequence is
+                the sum of their logarithms
+    '''
+    n_states = transition_probs.shape[0]
+    length_seq = len(seq_int)
+    alpha = np.zeros((n_states, length_seq))
+    scales = np.zeros(length_seq)
+    for state in range(n_states):
+        alpha[state, 0] = starting_probs[state] *\
+                emission_probs[seq_int[0], state]
+        scales[0] += alpha[state, 0]
+    alpha[:, 0] /= scales[0]
+    for i in range(1, length_seq):
+        symb = seq_int[i]
+        for state in range(n_states):
+            prob = 0.0
+            for prev_state in range(n_states):
+                prob += alpha[prev_state, i-1] *\
+                        transition_probs[prev_state, state]
+            alpha[state, i] = prob * emission_probs[symb, state]
+            scales[i] += alpha[state, i]
+        alpha[:, i] /= scales[i]
+    return alpha, scales
+
+@jit
+def backward(seq_int, emission_probs, transition_probs, scales):
+    '''
+    Scaled backward algorithm, using the scaling factors of the forward
+    algorithm
+    OUTPUT:
+        - beta: scaled backward variables (n_states x length_seq)
+    '''
+    n_states = transition_probs.shape[0]
+    length_seq = len(seq_int)
+    beta = np.zeros((n_states, length_seq))
+    beta[:, length_seq-1] = 1.0
+    for i in range(length_seq - 2, -1, -1):
+        symb = seq_int[i+1]
+        for state in range(n_states):
+            prob = 0.0
+            for next_state in range(n_states):
+                prob += transition_probs[state, next_state] *\
+                        emission_probs[symb, next_state] *\
+                        beta[next_state, i+1]
+            beta[state, i] = prob / scales[i+1]
+    return beta
+
+def log_likelihood(seq_int, emission_probs, transition_probs,
+        starting_probs):
+    '''
+    Log-likelihood of a sequence of symbols
+    '''
+    alpha, scales = forward(np.asarray(seq_int), emission_probs,
+            transition_probs, starting_probs)
+    return np.sum(np.log(scales))
+
+def posteriors(seq_int, emission_probs, transition_probs, starting_probs):
+    '''
+    Posterior probabilities of the states
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+    OUTPUT:
+        - gamma: posterior probability of every state at every position
+                (n_states x length_seq)
+    '''
+    seq_int = np.asarray(seq_int)
+    alpha, scales = forward(seq_int, emission_probs, transition_probs,
+            starting_probs)
+    beta = backward(seq_int, emission_probs, transition_probs, scales)
+    return alpha * beta
+
+def posterior_decoding(seq_int, emission_probs, transition_probs,
+        starting_probs):
+    '''
+    Decodes a sequence by taking the most probable state at every position
+    '''
+    return np.argmax(posteriors(seq_int, emission_probs, transition_probs,
+            starting_probs), axis=0)
+
+@jit
+def accumulate_statistics(seq_int, emission_probs, transition_probs, alpha,
+        beta, scales, starting_counts, transition_counts, emission_counts):
+    '''
+    Adds the expected counts of one sequence to the sufficient statistics
+    '''
+    n_states = transition_probs.shape[0]
+    length_seq = len(seq_int)
+    for state in range(n_states):
+        starting_counts[state] += alpha[state, 0] * beta[state, 0]
+    for i in range(length_seq):
+        symb = seq_int[i]
+        for state in range(n_states):
+            emission_counts[symb, state] += alpha[state, i] * beta[state, i]
+    for i in range(length_seq - 1):
+        symb = seq_int[i+1]
+        for state in range(n_states):
+            for next_state in range(n_states):
+                transition_counts[state, next_state] += alpha[state, i] *\
+                        transition_probs[state, next_state] *\
+                        emission_probs[symb, next_state] *\
+                        beta[next_state, i+1] / scales[i+1]
+
+def sufficient_statistics(seqs, emission_probs, transition_probs,
+        starting_probs):
+    '''
+    Expected counts of the starting states, transitions and emissions for a
+    list of sequences
+    OUTPUT:
+        - starting_counts, transition_counts, emission_counts, log_lik
+    '''
+    starting_counts = np.zeros_like(starting_probs)
+    transition_counts = np.zeros_like(transition_probs)
+    emission_counts = np.zeros_like(emission_probs)
+    log_lik = 0.0
+    for seq_int in seqs:
+        seq_int = np.asarray(seq_int)
+        alpha, scales = forward(seq_int, emission_probs, transition_probs,
+                starting_probs)
+        beta = backward(seq_int, emission_probs, transition_probs, scales)
+        accumulate_statistics(seq_int, emission_probs, transition_probs,
+                alpha, beta, scales, starting_counts, transition_counts,
+                emission_counts)
+        log_lik += np.sum(np.log(scales))
+    return starting_counts, transition_counts, emission_counts, log_lik
+
+def _sufficient_statistics_worker(args):
+    return sufficient_statistics(*args)
+
+def baum_welch(seqs, emission_probs, transition_probs, starting_probs,
+        max_iter=100, tol=1e-6, pseudocount=0.0, n_jobs=1, verbose=False):
+    '''
+    Estimates the parameters of a HMM using the Baum-Welch algorithm
+    INPUTS:
+        - seqs: list of sequences of symbol indices
+        - emission_probs: initial emission_probabilities
+        - transition_probs: initial transition probabilities
+        - starting_probs: initial starting probabilities
+        - max_iter: maximal number of EM iterations (default: 100)
+        - tol: stop when the log-likelihood improves less (default: 1e-6)
+        - pseudocount: added to all expected counts (default: 0)
+        - n_jobs: number of worker processes computing the expected counts
+                (default: 1)
+        - verbose: print the log-likelihood at every iteration
+    OUTPUT:
+        - emission_probs, transition_probs, starting_probs: the estimated
+                parameters
+        - log_liks: the log-likelihood of the data at every iteration
+    '''
+    emission_probs = np.array(emission_probs, dtype=float)
+    transition_probs = np.array(transition_probs, dtype=float)
+    starting_probs = np.array(starting_probs, dtype=float)
+    n_batches = min(n_jobs, len(seqs))
+    batches = [seqs[i::n_batches] for i in range(n_batches)]
+    pool = Pool(n_jobs) if n_jobs > 1 else None
+    log_liks = []
+    try:
+        for iteration in range(max_iter):
+            # E-step
+            args = [(batch, emission_probs, transition_probs, starting_probs)
+                        for batch in batches]
+            if pool is None:
+                statistics = list(map(_sufficient_statistics_worker, args))
+            else:
+                statistics = pool.map(_sufficient_statistics_worker, args)
+            starting_counts, transition_counts, emission_counts, log_lik =\
+                    [sum(stats) for stats in zip(*statistics)]
+            log_liks.append(log_lik)
+            if verbose:
+                print('iteration {}: log-likelihood {}'.format(iteration,
+                                                                log_lik))
+            # M-step
+            starting_counts = starting_counts + pseudocount
+            transition_counts = transition_counts + pseudocount
+            emission_counts = emission_counts + pseudocount
+            starting_probs = starting_counts / starting_counts.sum()
+            transition_probs = transition_counts /\
+                    transition_counts.sum(1).reshape((-1, 1))
+            emission_probs = emission_counts /\
+                    emission_counts.sum(0).reshape((1, -1))
+            if iteration > 0 and log_liks[-1] - log_liks[-2] < tol:
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+    return emission_probs, transition_probs, starting_probs, log_liks
+
+
+
+if __name__=='__main__':
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    sequence = 'HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH'*5
+
+    print(sequence)
+    print(int_to_states(posterior_decoding(symbols_to_int(sequence),
+            emis_probs, trans_probs, starting_probs)))
+
+    emis_probs, trans_probs, starting_probs, log_liks = baum_welch(
+            [symbols_to_int(sequence)], np.array([[0.6, 0.3], [0.4, 0.7]]),
+            np.array([[0.7, 0.3], [0.3, 0.7]]), np.array([0.5, 0.5]))
+    print(emis_probs)
+    print(trans_probs)
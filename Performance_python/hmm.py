@@ -0,0 +1,138 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+HMM class for repeated Viterbi decoding with the same model
+
+The parameters are validated and log-transformed once, the dynamic
+programming matrix and the pointers are reused between calls (they only grow
+when a longer sequence is decoded) and the numba kernels are compiled when the
+model is constructed.
+"""
+
+import numpy as np
+from numba import jit
+from viterbi_numba4 import backtracking
+
+@jit
+def fill_log_dyn_prog_matrix(seq_int, log_emission, log_transition,
+        log_starting, dyn_prog_matrix, pointers, length_seq):
+    '''
+    Same as fill_dyn_prog_matrix in viterbi_numba4.py, but works with the log
+    of the parameters and only fills the first length_seq columns
+    '''
+    n_states = log_transition.shape[0]
+    # initialise the matrix
+    for state in range(n_states):
+        dyn_prog_matrix[state, 0] = log_starting[state] +\
+                log_emission[seq_int[0], state]
+    # now fill the rest
+    for i in range(1, length_seq):
+        symb = seq_int[i]
+        for state in range(n_states):
+            best_log_prob = -np.inf
+            best_prev_state = 0
+            for prev_state in range(n_states):
+                log_prob = dyn_prog_matrix[prev_state, i-1] +\
+                    log_transition[prev_state, state] +\
+                    log_emission[symb, state]
+                if log_prob > best_log_prob:
+                    best_log_prob = log_prob
+                    best_prev_state = prev_state
+            dyn_prog_matrix[state, i] = best_log_prob
+            pointers[state, i] = best_prev_state
+    return dyn_prog_matrix, pointers
+
+class HMM(object):
+    """
+    Hidden Markov model with cached log-parameters for Viterbi decoding.
+    """
+    def __init__(self, emission_probs, transition_probs, starting_probs,
+                        initial_length=1000):
+        '''
+        INPUTS:
+            - emission_probs: emission_probabilities (n_symbols x n_states)
+            - transition_probs: transition probabilities (n_states x n_states)
+            - starting_probs: starting probabilities (n_states, )
+            - initial_length: initial size of the buffers (default: 1000)
+        '''
+        super(HMM, self).__init__()
+        emission_probs = np.asarray(emission_probs, dtype=float)
+        transition_probs = np.asarray(transition_probs, dtype=float)
+        starting_probs = np.asarray(starting_probs, dtype=float)
+        n_symbols, n_states = emission_probs.shape
+        assert transition_probs.shape == (n_states, n_states),\
+                'transition_probs should be n_states x n_states'
+        assert starting_probs.shape == (n_states, ),\
+                'starting_probs should have length n_states'
+        for name, probs in [('emission_probs', emission_probs.T),
+                            ('transition_probs', transition_probs),
+                            ('starting_probs', starting_probs)]:
+            assert np.all(probs >= 0), name + ' should be nonnegative'
+            assert np.allclose(probs.sum(-1), 1), name + ' should sum to one'
+        self.n_symbols = n_symbols
+        self.n_states = n_states
+        # log of zero is -inf, which is what we want
+        with np.errstate(divide='ignore'):
+            self.log_emission = np.log(emission_probs)
+            self.log_transition = np.log(transition_probs)
+            self.log_starting = np.log(starting_probs)
+        self._allocate(max(initial_length, 2))
+        # compile the kernels
+        self.viterbi(np.zeros(2, dtype=np.int64))
+
+    def _allocate(self, length_seq):
+        '''
+        (Re)allocates the buffers for sequences up to length_seq
+        '''
+        # one spare column, such that the views passed to backtracking always
+        # have the same layout and do not trigger a new compilation
+        self.dyn_prog_matrix = np.zeros((self.n_states, length_seq + 1))
+        self.pointers = np.zeros((self.n_states, length_seq + 1),
+                dtype=np.int64)
+        self.seq = np.zeros(length_seq + 1, dtype=np.int64)
+
+    def viterbi(self, seq_int):
+        '''
+        Finds the most likely sequence of states for a sequence of symbols
+        INPUTS:
+            - seq_int: list of symbol indices
+        OUTPUT:
+            - array with the indices of the states
+        '''
+        seq_int = np.ascontiguousarray(seq_int, dtype=np.int64)
+        length_seq = len(seq_int)
+        assert length_seq > 0, 'can not decode an empty sequence'
+        assert seq_int.min() >= 0 and seq_int.max() < self.n_symbols,\
+                'unknown symbol in the sequence'
+        if length_seq >= self.seq.shape[0]:
+            self._allocate(length_seq)
+        fill_log_dyn_prog_matrix(seq_int, self.log_emission,
+                self.log_transition, self.log_starting, self.dyn_prog_matrix,
+                self.pointers, length_seq)
+        return backtracking(self.dyn_prog_matrix[:, :length_seq],
+                self.pointers[:, :length_seq], self.seq[:length_seq]).copy()
+
+
+
+if __name__=='__main__':
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    hmm = HMM(emis_probs, trans_probs, starting_probs)
+
+    for sequence in ['HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH',
+                     'TTTTTTTTTTHH']:
+        print(sequence)
+        print(int_to_states(hmm.viterbi(symbols_to_int(sequence))))
@@ -0,0 +1,118 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Batched Viterbi decoding of many sequences of different lengths sharing one HMM
+
+The sequences are padded to a common length and decoded together, vectorized
+over the batch and the states. Positions beyond the end of a sequence are
+masked: the scores are frozen and the pointers point to the state itself, so
+the backtracking runs through the padding without changing the state.
+"""
+
+import numpy as np
+from viterbi_vectorized import log_model
+
+def pad_sequences(seqs, pad_value=0):
+    '''
+    Puts a list of sequences of symbol indices in a padded matrix
+    INPUTS:
+        - seqs: list of sequences of symbol indices
+        - pad_value: symbol index used for the padding (default: 0)
+    OUTPUT:
+        - padded_seqs: matrix (n_seqs x max_length) of symbol indices
+        - lengths: the length of each sequence
+    '''
+    lengths = np.array([len(seq) for seq in seqs], dtype=int)
+    padded_seqs = np.full((len(seqs), lengths.max()), pad_value, dtype=int)
+    for i, seq in enumerate(seqs):
+        padded_seqs[i, :lengths[i]] = seq
+    return padded_seqs, lengths
+
+def viterbi_batch(seqs, emission_probs, transition_probs,
+        starting_probs, lengths=None):
+    '''
+    Decodes a batch of sequences using the Viterbi algorithm
+    INPUTS:
+        - seqs: list of sequences of symbol indices or a padded matrix
+                (n_seqs x max_length) of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+        - lengths: lengths of the sequences if seqs is a padded matrix
+                (default: all sequences have the full length)
+    OUTPUT:
+        - list with the most likely sequence of states for each sequence
+    '''
+    if lengths is None and not isinstance(seqs, np.ndarray):
+        padded_seqs, lengths = pad_sequences(seqs)
+    else:
+        padded_seqs = np.asarray(seqs, dtype=int)
+        if lengths is None:
+            lengths = np.full(padded_seqs.shape[0], padded_seqs.shape[1])
+        lengths = np.asarray(lengths, dtype=int)
+    assert np.all(lengths > 0), 'empty sequences can not be decoded'
+    log_emission, log_transition, log_starting = log_model(emission_probs,
+            transition_probs, starting_probs)
+    n_seqs, max_length = padded_seqs.shape
+    n_states = log_transition.shape[0]
+    states = np.arange(n_states)
+    # pointers[i, seq, state]: best previous state at position i
+    pointers = np.zeros((max_length, n_seqs, n_states), dtype=int)
+    pointers[0] = states
+    scores = log_starting + log_emission[padded_seqs[:, 0]]
+    for i in range(1, max_length):
+        # element [seq, prev_state, state]
+        log_probs = scores[:, :, None] + log_transition[None, :, :] +\
+                log_emission[padded_seqs[:, i]][:, None, :]
+        best_prev = np.argmax(log_probs, axis=1)
+        new_scores = np.take_along_axis(log_probs, best_prev[:, None, :],
+                axis=1)[:, 0, :]
+        # mask the sequences that have already ended
+        active = (i < lengths).reshape((-1, 1))
+        scores = np.where(active, new_scores, scores)
+        pointers[i] = np.where(active, best_prev, states)
+    return backtracking_batch(scores, pointers, lengths)
+
+def backtracking_batch(scores, pointers, lengths):
+    '''
+    Uses backtracking to find the best sequence for every sequence in the
+    batch at once
+    '''
+    max_length, n_seqs, _ = pointers.shape
+    seqs = np.arange(n_seqs)
+    paths = np.zeros((n_seqs, max_length), dtype=int)
+    pointy_fingers = np.argmax(scores, axis=1)
+    pos = max_length - 1
+    paths[:, pos] = pointy_fingers
+    while pos >= 1:
+        pointy_fingers = pointers[pos, seqs, pointy_fingers]
+        pos -= 1
+        paths[:, pos] = pointy_fingers
+    return [path[:length] for path, length in zip(paths, lengths)]
+
+
+
+if __name__=='__main__':
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    sequences = ['HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH',
+                 'TTTTTTTTTTHH', 'HTHTHHHTHTHHTHHTTTTTTTTTTTTTTTHTTHTH']
+
+    for sequence, path in zip(sequences,
+                viterbi_batch([symbols_to_int(seq) for seq in sequences],
+                    emis_probs, trans_probs, starting_probs)):
+        print(sequence)
+        print(int_to_states(path))
@@ -0,0 +1,141 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Approximate Viterbi decoding using beam search
+
+Only the best states of every column (the top beam_width and/or those within
+threshold of the best score) survive and are extended to the next column.
+Pointers are only stored for the survivors. This is no longer guaranteed to
+find the most likely path: use beam_report to check how often the beam
+changes the result on a sample of sequences.
+"""
+
+import numpy as np
+from time import time
+from viterbi_vectorized import log_model
+from viterbi_vectorized import viterbi as viterbi_exact
+
+def select_survivors(scores, beam_width=None, threshold=None):
+    '''
+    Selects the states in the beam, sorted by index
+    INPUTS:
+        - scores: scores of all states
+        - beam_width: maximal number of surviving states (default: None)
+        - threshold: only keep states with a score within threshold of the
+                best score (default: None)
+    '''
+    best_score = np.max(scores)
+    keep = scores > -np.inf
+    if threshold is not None:
+        keep &= scores >= best_score - threshold
+    survivors = np.flatnonzero(keep)
+    if beam_width is not None and len(survivors) > beam_width:
+        top = np.argpartition(-scores[survivors], beam_width - 1)[:beam_width]
+        survivors = np.sort(survivors[top])
+    if len(survivors) == 0:
+        survivors = np.array([np.argmax(scores)])
+    return survivors
+
+def viterbi(seq_int, emission_probs, transition_probs,
+        starting_probs, beam_width=10, threshold=None):
+    '''
+    Finds an approximation of the most likely sequence of states using beam
+    search
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+        - beam_width: number of surviving states per position (default: 10)
+        - threshold: only keep states with a log-probability within
+                threshold of the best one (default: None)
+    OUTPUT:
+        - array with the indices of the states
+    '''
+    log_emission, log_transition, log_starting = log_model(emission_probs,
+            transition_probs, starting_probs)
+    n_states = log_transition.shape[0]
+    length_seq = len(seq_int)
+    all_scores = log_starting + log_emission[seq_int[0]]
+    survivors = select_survivors(all_scores, beam_width, threshold)
+    scores = all_scores[survivors]
+    # for every position, the surviving states and, for each of them, the
+    # index of the previous state in the previous beam
+    beam_states = [survivors]
+    beam_pointers = [None]
+    for symb in seq_int[1:]:
+        # element [surviving prev_state, state]
+        log_probs = scores.reshape((-1, 1)) + log_transition[survivors] +\
+                log_emission[symb].reshape((1, -1))
+        pointers = np.argmax(log_probs, axis=0)
+        all_scores = log_probs[pointers, np.arange(n_states)]
+        survivors = select_survivors(all_scores, beam_width, threshold)
+        scores = all_scores[survivors]
+        beam_states.append(survivors)
+        beam_pointers.append(pointers[survivors])
+    # backtracking within the beams
+    seq = np.zeros(length_seq, dtype=int)
+    pointy_finger = np.argmax(scores)
+    for pos in range(length_seq - 1, -1, -1):
+        seq[pos] = beam_states[pos][pointy_finger]
+        if pos > 0:
+            pointy_finger = beam_pointers[pos][pointy_finger]
+    return seq
+
+def beam_report(seqs, emission_probs, transition_probs, starting_probs,
+        beam_width=10, threshold=None):
+    '''
+    Compares beam search with exact decoding on a sample of sequences
+    INPUTS:
+        - seqs: list of sequences of symbol indices
+        - emission_probs, transition_probs, starting_probs: the HMM
+        - beam_width, threshold: settings of the beam
+    OUTPUT:
+        - dictionary with the fraction of sequences for which the decoded
+                path changed, the fraction of positions that changed and the
+                time of the exact and the beam decoding
+    '''
+    n_changed_seqs = 0
+    n_changed_positions = 0
+    time_exact = 0.0
+    time_beam = 0.0
+    for seq_int in seqs:
+        t0 = time()
+        path_exact = viterbi_exact(seq_int, emission_probs, transition_probs,
+                starting_probs)
+        t1 = time()
+        path_beam = viterbi(seq_int, emission_probs, transition_probs,
+                starting_probs, beam_width, threshold)
+        t2 = time()
+        time_exact += t1 - t0
+        time_beam += t2 - t1
+        n_changed = np.sum(path_exact != path_beam)
+        n_changed_seqs += n_changed > 0
+        n_changed_positions += n_changed
+    return {'fraction_sequences_changed' : float(n_changed_seqs) / len(seqs),
+            'fraction_positions_changed' : float(n_changed_positions) /\
+                    sum(len(seq_int) for seq_int in seqs),
+            'time_exact' : time_exact,
+            'time_beam' : time_beam}
+
+
+
+if __name__=='__main__':
+
+    n_states = 200
+    n_symbols = 20
+
+    # sticky model
+    transition_probs = np.random.dirichlet(np.ones(n_states) * 0.05, n_states)
+    transition_probs = 0.9 * np.eye(n_states) + 0.1 * transition_probs
+    emission_probs = np.random.dirichlet(np.ones(n_symbols), n_states).T
+    starting_probs = np.ones(n_states) / n_states
+
+    seqs = [np.random.randint(0, n_symbols, 100) for _ in range(10)]
+    for beam_width in [5, 20, 100]:
+        print(beam_width, beam_report(seqs, emission_probs, transition_probs,
+                starting_probs, beam_width))
@@ -0,0 +1,144 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Memory-light implementation of the Viterbi algorithm
+
+Only two columns of scores are kept during the forward pass and the pointers
+are stored in the smallest unsigned integer type that can hold n_states. With
+checkpointing, only every k-th column of scores is stored and the pointers are
+recomputed segment per segment during the backtracking, so the memory is of
+the order of n_states * (length_seq / k + k) instead of
+n_states * length_seq.
+"""
+
+import numpy as np
+from numba import jit
+from viterbi_vectorized import log_model
+
+def pointer_dtype(n_states):
+    '''
+    Smallest unsigned integer type that can hold the indices of the states
+    '''
+    return np.min_scalar_type(max(n_states - 1, 0))
+
+@jit
+def forward_pass(seq_int, log_emission, log_transition, scores, start, stop,
+        pointers, store_pointers, checkpoints, checkpoint_every):
+    '''
+    Advances the column of scores (corresponding to position start) up to
+    position stop - 1, using a single extra column. If store_pointers is True,
+    the pointers of position i are stored at pointers[:, i - start - 1]. If
+    checkpoint_every > 0, the scores of every position that is a multiple of
+    checkpoint_every are stored in checkpoints.
+    '''
+    n_states = log_transition.shape[0]
+    new_scores = np.empty_like(scores)
+    for i in range(start + 1, stop):
+        symb = seq_int[i]
+        for state in range(n_states):
+            best_log_prob = -np.inf
+            best_prev_state = 0
+            for prev_state in range(n_states):
+                log_prob = scores[prev_state] +\
+                    log_transition[prev_state, state] +\
+                    log_emission[symb, state]
+                if log_prob > best_log_prob:
+                    best_log_prob = log_prob
+                    best_prev_state = prev_state
+            new_scores[state] = best_log_prob
+            if store_pointers:
+                pointers[state, i - start - 1] = best_prev_state
+        scores[:] = new_scores
+        if checkpoint_every > 0 and i % checkpoint_every == 0:
+            checkpoints[:, i // checkpoint_every] = scores
+    return scores
+
+@jit
+def backtracking_segment(pointers, seq, start, stop):
+    '''
+    Backtracks from the state at seq[stop] to position start, where
+    pointers[:, i - start - 1] contains the pointers of position i
+    '''
+    pointy_finger = seq[stop]
+    pos = stop
+    while pos > start:
+        pointy_finger = pointers[pointy_finger, pos - start - 1]
+        pos -= 1
+        seq[pos] = pointy_finger
+    return seq
+
+def viterbi(seq_int, emission_probs, transition_probs,
+        starting_probs, checkpoint_every=None):
+    '''
+    Finds the most likely sequence of states using a limited amount of memory
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+        - checkpoint_every: store only every k-th column of scores and
+                recompute the pointers during backtracking, 'sqrt' uses
+                k = sqrt(length_seq) (default: None, store all pointers)
+    OUTPUT:
+        - array with the indices of the states (in the pointer dtype)
+    '''
+    seq_int = np.asarray(seq_int)
+    if not np.issubdtype(seq_int.dtype, np.integer):
+        seq_int = seq_int.astype(int)
+    log_emission, log_transition, log_starting = log_model(emission_probs,
+            transition_probs, starting_probs)
+    n_states = log_transition.shape[0]
+    length_seq = len(seq_int)
+    dtype = pointer_dtype(n_states)
+    seq = np.zeros(length_seq, dtype=dtype)
+    scores = log_starting + log_emission[seq_int[0]]
+    if checkpoint_every == 'sqrt':
+        checkpoint_every = int(np.ceil(np.sqrt(length_seq)))
+    if checkpoint_every is None or checkpoint_every >= length_seq:
+        pointers = np.zeros((n_states, length_seq - 1), dtype=dtype)
+        scores = forward_pass(seq_int, log_emission, log_transition, scores,
+                0, length_seq, pointers, True, np.zeros((n_states, 0)), 0)
+        seq[-1] = np.argmax(scores)
+        return backtracking_segment(pointers, seq, 0, length_seq - 1)
+    # forward pass only storing the checkpoints
+    n_checkpoints = (length_seq - 1) // checkpoint_every + 1
+    checkpoints = np.zeros((n_states, n_checkpoints))
+    checkpoints[:, 0] = scores
+    scores = forward_pass(seq_int, log_emission, log_transition,
+            scores.copy(), 0, length_seq, np.zeros((n_states, 0), dtype=dtype),
+            False, checkpoints, checkpoint_every)
+    seq[-1] = np.argmax(scores)
+    # recompute the pointers of each segment, starting from the last
+    pointers = np.zeros((n_states, checkpoint_every), dtype=dtype)
+    for j in reversed(range(n_checkpoints)):
+        start = j * checkpoint_every
+        stop = min(start + checkpoint_every, length_seq - 1)
+        forward_pass(seq_int, log_emission, log_transition,
+                checkpoints[:, j].copy(), start, stop + 1, pointers, True,
+                checkpoints, 0)
+        backtracking_segment(pointers, seq, start, stop)
+    return seq
+
+
+
+if __name__=='__main__':
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    sequence = 'HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH'*5
+
+    print(sequence)
+    print(int_to_states(viterbi(symbols_to_int(sequence), emis_probs,\
+            trans_probs, starting_probs, checkpoint_every='sqrt')))
@@ -56,12 +56,12 @@ def backtracking(dyn_prog_matrix, pointers):
     Uses backtracking to find the best sequence
     '''
     pos = dyn_prog_matrix.shape[1] - 1
-    seq = np.zeros( dyn_prog_matrix.shape[1], dtype = int )
+    seq = np.zeros( dyn_prog_matrix.shape[1], dtype = np.int64 )
     pointy_finger = np.argmax(dyn_prog_matrix[:, -1])
     seq[pos] = pointy_finger
     while pos >= 1:
-        pos -= 1
         pointy_finger = pointers[pointy_finger, pos]
+        pos -= 1
         seq[pos] = pointy_finger
     return seq
 
@@ -76,8 +76,8 @@ if __name__=='__main__':
     trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
     starting_probs = np.array([0.99, 0.01])
 
-    symbols_to_int = lambda seq : np.array(map(lambda s : symbols.index(s), seq), dtype=int)
-    states_to_int = lambda seq : np.array(map(lambda s : states.index(s), seq), dtype=int)
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    states_to_int = lambda seq : np.array([states.index(s) for s in seq], dtype=int)
 
     int_to_symbols = lambda ints : ''.join(map(lambda i: symbols[i], ints))
     int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
@@ -0,0 +1,220 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Parallel Viterbi decoding of a single long sequence
+
+The Viterbi recursion is a sequence of matrix-vector products in the max-plus
+semiring, hence the sequence can be split into chunks that are processed
+independently:
+
+    1. (parallel) for every chunk, compute the max-plus transfer matrix: the
+       best log-probability to go from every state just before the chunk to
+       every state at the end of the chunk
+    2. (sequential, cheap) propagate the scores at the chunk boundaries using
+       these n_states x n_states matrices
+    3. (parallel) rerun the Viterbi algorithm for every chunk starting from
+       the exact incoming scores and store the pointers
+    4. (sequential, cheap) link the chunks by finding the state at the start
+       of every chunk given the state at its end
+    5. (parallel) backtrack within every chunk
+
+Computing the transfer matrices costs n_states times the work of the serial
+algorithm, so this pays off when the number of cores exceeds the number of
+states. The result is the Viterbi path, up to ties that are broken differently
+due to rounding.
+"""
+
+import numpy as np
+from numba import jit, prange, get_num_threads
+from viterbi_vectorized import log_model
+
+@jit(nogil=True)
+def transfer_matrix(seq_int, log_emission, log_transition, start, stop):
+    '''
+    Max-plus transfer matrix of the chunk seq_int[start:stop], element [i, j]
+    is the best log-probability of going from state i at position start - 1
+    to state j at position stop - 1 (including the emissions of the chunk)
+    '''
+    n_states = log_transition.shape[0]
+    transfer = np.empty((n_states, n_states))
+    new_transfer = np.empty((n_states, n_states))
+    symb = seq_int[start]
+    for init_state in range(n_states):
+        for state in range(n_states):
+            transfer[init_state, state] = log_transition[init_state, state] +\
+                    log_emission[symb, state]
+    for i in range(start + 1, stop):
+        symb = seq_int[i]
+        for init_state in range(n_states):
+            for state in range(n_states):
+                best_log_prob = -np.inf
+                for prev_state in range(n_states):
+                    log_prob = transfer[init_state, prev_state] +\
+                        log_transition[prev_state, state] +\
+                        log_emission[symb, state]
+                    if log_prob > best_log_prob:
+                        best_log_prob = log_prob
+                new_transfer[init_state, state] = best_log_prob
+        transfer[:, :] = new_transfer
+    return transfer
+
+@jit(nogil=True)
+def fill_chunk(seq_int, log_emission, log_transition, scores, start, stop,
+        pointers):
+    '''
+    Viterbi algorithm on seq_int[start:stop] starting from the scores of
+    position start - 1, pointers[:, i] contains the pointers of position i
+    '''
+    n_states = log_transition.shape[0]
+    scores = scores.copy()
+    new_scores = np.empty_like(scores)
+    for i in range(start, stop):
+        symb = seq_int[i]
+        for state in range(n_states):
+            best_log_prob = -np.inf
+            best_prev_state = 0
+            for prev_state in range(n_states):
+                log_prob = scores[prev_state] +\
+                    log_transition[prev_state, state] +\
+                    log_emission[symb, state]
+                if log_prob > best_log_prob:
+                    best_log_prob = log_prob
+                    best_prev_state = prev_state
+            new_scores[state] = best_log_prob
+            pointers[state, i] = best_prev_state
+        scores[:] = new_scores
+    return scores
+
+@jit(nogil=True)
+def chunk_origins(pointers, start, stop):
+    '''
+    For every state at position stop - 1, the state at position start - 1
+    the best path comes from
+    '''
+    n_states = pointers.shape[0]
+    origins = np.empty(n_states, dtype=np.int64)
+    for state in range(n_states):
+        pointy_finger = state
+        for pos in range(stop - 1, start - 1, -1):
+            pointy_finger = pointers[pointy_finger, pos]
+        origins[state] = pointy_finger
+    return origins
+
+@jit(nogil=True)
+def backtracking_chunk(pointers, seq, start, stop, last_state):
+    '''
+    Backtracks within the chunk from last_state at position stop - 1
+    '''
+    pointy_finger = last_state
+    seq[stop - 1] = pointy_finger
+    for pos in range(stop - 1, start, -1):
+        pointy_finger = pointers[pointy_finger, pos]
+        seq[pos - 1] = pointy_finger
+    return seq
+
+@jit(parallel=True)
+def parallel_transfer_matrices(seq_int, log_emission, log_transition,
+        boundaries):
+    n_chunks = len(boundaries) - 1
+    n_states = log_transition.shape[0]
+    transfers = np.empty((n_chunks, n_states, n_states))
+    for chunk in prange(n_chunks):
+        transfers[chunk] = transfer_matrix(seq_int, log_emission,
+                log_transition, boundaries[chunk], boundaries[chunk + 1])
+    return transfers
+
+@jit(parallel=True)
+def parallel_fill_chunks(seq_int, log_emission, log_transition,
+        incoming_scores, boundaries, pointers):
+    n_chunks = len(boundaries) - 1
+    n_states = log_transition.shape[0]
+    final_scores = np.empty((n_chunks, n_states))
+    origins = np.empty((n_chunks, n_states), dtype=np.int64)
+    for chunk in prange(n_chunks):
+        start, stop = boundaries[chunk], boundaries[chunk + 1]
+        final_scores[chunk] = fill_chunk(seq_int, log_emission,
+                log_transition, incoming_scores[chunk], start, stop, pointers)
+        origins[chunk] = chunk_origins(pointers, start, stop)
+    return final_scores, origins
+
+@jit(parallel=True)
+def parallel_backtracking(pointers, boundaries, last_states, seq):
+    n_chunks = len(boundaries) - 1
+    for chunk in prange(n_chunks):
+        backtracking_chunk(pointers, seq, boundaries[chunk],
+                boundaries[chunk + 1], last_states[chunk])
+    return seq
+
+def viterbi(seq_int, emission_probs, transition_probs,
+        starting_probs, n_chunks=None):
+    '''
+    Finds the most likely sequence of states, processing chunks of the
+    sequence in parallel
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+        - n_chunks: number of chunks (default: the number of threads of
+                numba)
+    OUTPUT:
+        - array with the indices of the states
+    '''
+    seq_int = np.ascontiguousarray(seq_int, dtype=np.int64)
+    log_emission, log_transition, log_starting = log_model(emission_probs,
+            transition_probs, starting_probs)
+    n_states = log_transition.shape[0]
+    length_seq = len(seq_int)
+    initial_scores = log_starting + log_emission[seq_int[0]]
+    if length_seq == 1:
+        return np.array([np.argmax(initial_scores)])
+    if n_chunks is None:
+        n_chunks = get_num_threads()
+    # the first position is handled by the starting probabilities
+    n_chunks = min(n_chunks, length_seq - 1)
+    boundaries = np.linspace(1, length_seq, n_chunks + 1).astype(np.int64)
+    # scores entering every chunk
+    transfers = parallel_transfer_matrices(seq_int, log_emission,
+            log_transition, boundaries)
+    incoming_scores = np.empty((n_chunks, n_states))
+    incoming_scores[0] = initial_scores
+    for chunk in range(1, n_chunks):
+        incoming_scores[chunk] = np.max(incoming_scores[chunk-1].reshape((-1, 1))
+                    + transfers[chunk-1], axis=0)
+    # exact pointers within every chunk
+    pointers = np.zeros((n_states, length_seq), dtype=np.int64)
+    final_scores, origins = parallel_fill_chunks(seq_int, log_emission,
+            log_transition, incoming_scores, boundaries, pointers)
+    # link the chunks, starting from the best final state
+    last_states = np.zeros(n_chunks, dtype=np.int64)
+    state = np.argmax(final_scores[-1])
+    for chunk in reversed(range(n_chunks)):
+        last_states[chunk] = state
+        state = origins[chunk, state]
+    seq = np.zeros(length_seq, dtype=np.int64)
+    seq[0] = state
+    return parallel_backtracking(pointers, boundaries, last_states, seq)
+
+
+
+if __name__=='__main__':
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    sequence = 'HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH'*5
+
+    print(sequence)
+    print(int_to_states(viterbi(symbols_to_int(sequence), emis_probs,\
+            trans_probs, starting_probs, n_chunks=4)))
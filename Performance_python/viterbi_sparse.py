@@ -0,0 +1,114 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Viterbi algorithm for HMMs with sparse transition matrices
+
+For structured models (left-to-right profile HMMs, banded models...) most
+transitions are impossible. Here, the transitions are stored in compressed
+sparse row format by destination state, such that only the allowed
+predecessors of every state are visited. The cost scales with the number of
+allowed transitions rather than with the square of the number of states.
+"""
+
+import numpy as np
+from numba import jit
+from scipy.sparse import csr_matrix, issparse
+from viterbi_memory import pointer_dtype, backtracking_segment
+
+def predecessors(transition_probs):
+    '''
+    Stores the allowed transitions by destination state
+    INPUTS:
+        - transition_probs: transition probabilities, either a dense array or
+                a scipy sparse matrix (n_states x n_states)
+    OUTPUT:
+        - indptr, indices, log_probs: the predecessors of state j are
+                indices[indptr[j]:indptr[j+1]] (sorted) with the log of the
+                transition probabilities in log_probs
+    '''
+    if issparse(transition_probs):
+        to_state = csr_matrix(transition_probs.T)
+    else:
+        to_state = csr_matrix(np.asarray(transition_probs, dtype=float).T)
+    to_state.eliminate_zeros()
+    to_state.sort_indices()
+    return (to_state.indptr.astype(np.int64),
+            to_state.indices.astype(np.int64),
+            np.log(to_state.data.astype(float)))
+
+@jit
+def fill_sparse_dyn_prog(seq_int, log_emission, indptr, indices, log_probs,
+        scores, pointers):
+    '''
+    Viterbi forward pass only visiting the allowed predecessors, keeping two
+    columns of scores, pointers[:, i-1] contains the pointers of position i
+    '''
+    n_states = len(indptr) - 1
+    new_scores = np.empty_like(scores)
+    for i in range(1, len(seq_int)):
+        symb = seq_int[i]
+        for state in range(n_states):
+            best_log_prob = -np.inf
+            best_prev_state = 0
+            for k in range(indptr[state], indptr[state+1]):
+                log_prob = scores[indices[k]] + log_probs[k] +\
+                        log_emission[symb, state]
+                if log_prob > best_log_prob:
+                    best_log_prob = log_prob
+                    best_prev_state = indices[k]
+            new_scores[state] = best_log_prob
+            pointers[state, i-1] = best_prev_state
+        scores[:] = new_scores
+    return scores
+
+def viterbi(seq_int, emission_probs, transition_probs,
+        starting_probs):
+    '''
+    Finds the most likely sequence of states, only considering the nonzero
+    transitions
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities (dense or scipy sparse)
+        - starting_probs: starting probabilities
+    OUTPUT:
+        - array with the indices of the states
+    '''
+    seq_int = np.asarray(seq_int)
+    indptr, indices, log_probs = predecessors(transition_probs)
+    with np.errstate(divide='ignore'):
+        log_emission = np.log(np.asarray(emission_probs, dtype=float))
+        log_starting = np.log(np.asarray(starting_probs, dtype=float))
+    n_states = len(indptr) - 1
+    length_seq = len(seq_int)
+    dtype = pointer_dtype(n_states)
+    pointers = np.zeros((n_states, length_seq - 1), dtype=dtype)
+    scores = log_starting + log_emission[seq_int[0]]
+    scores = fill_sparse_dyn_prog(seq_int, log_emission, indptr, indices,
+            log_probs, scores, pointers)
+    seq = np.zeros(length_seq, dtype=dtype)
+    seq[-1] = np.argmax(scores)
+    return backtracking_segment(pointers, seq, 0, length_seq - 1)
+
+
+
+if __name__=='__main__':
+
+    from scipy.sparse import diags
+
+    # left-to-right model: stay or move to the next state
+    n_states = 100
+    n_symbols = 4
+    transition_probs = diags([np.full(n_states, 0.9),
+                              np.full(n_states - 1, 0.1)], [0, 1]).tolil()
+    transition_probs[-1, -1] = 1.0
+    emission_probs = np.random.dirichlet(np.ones(n_symbols), n_states).T
+    starting_probs = np.zeros(n_states)
+    starting_probs[0] = 1.0
+
+    seq_int = np.random.randint(0, n_symbols, 1000)
+    print(viterbi(seq_int, emission_probs, transition_probs, starting_probs))
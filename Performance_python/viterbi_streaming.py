@@ -0,0 +1,190 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Streaming Viterbi decoder for unbounded sequences
+
+The symbols are processed in chunks and the decoded states are emitted as
+soon as the survivor paths of all the states coalesce: from that position on,
+the states can not change anymore, whatever symbols follow. Optionally, the
+decoder forces a decision when the undecided part exceeds a fixed lag, such
+that memory and latency are bounded (at the cost of optimality).
+"""
+
+import numpy as np
+from viterbi_vectorized import log_model, next_column
+
+class StreamingViterbi(object):
+    """
+    Online Viterbi decoder with bounded-lag output.
+    """
+    def __init__(self, emission_probs, transition_probs, starting_probs,
+                        max_lag=None):
+        '''
+        INPUTS:
+            - emission_probs: emission_probabilities
+            - transition_probs: transition probabilities
+            - starting_probs: starting probabilities
+            - max_lag: maximal number of undecided positions before a
+                    decision is forced (default: None, only emit exact
+                    decisions)
+        '''
+        super(StreamingViterbi, self).__init__()
+        self.log_emission, self.log_transition, self.log_starting =\
+                log_model(emission_probs, transition_probs, starting_probs)
+        self.n_states = self.log_transition.shape[0]
+        self.max_lag = max_lag
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts decoding a new sequence
+        '''
+        self.scores = None
+        # pointers[j] contains the pointers of the (j+1)-th undecided position
+        self.pointers = []
+        self.n_decoded = 0
+
+    def n_pending(self):
+        '''
+        Number of positions that are read, but not decoded yet
+        '''
+        return 0 if self.scores is None else len(self.pointers) + 1
+
+    def update(self, symbols):
+        '''
+        Processes a chunk of symbols
+        INPUTS:
+            - symbols: list of symbol indices
+        OUTPUT:
+            - array with the states that could be decoded
+        '''
+        for symb in symbols:
+            if self.scores is None:
+                self.scores = self.log_starting + self.log_emission[symb]
+            else:
+                self.scores, pointers = next_column(self.scores,
+                        self.log_transition, self.log_emission[symb])
+                self.pointers.append(pointers)
+            # only differences matter, avoid losing precision on long streams
+            best_score = np.max(self.scores)
+            if -np.inf < best_score < -1e6:
+                self.scores -= best_score
+        decoded = [self._emit_coalesced()]
+        if self.max_lag is not None and self.n_pending() > self.max_lag:
+            decoded.append(self._emit_forced(self.n_pending() - self.max_lag))
+        return np.concatenate(decoded)
+
+    def finish(self):
+        '''
+        Decodes the remaining positions at the end of the sequence and resets
+        the decoder
+        '''
+        if self.scores is None:
+            return np.zeros(0, dtype=int)
+        decoded = self._emit_forced(self.n_pending())
+        self.reset()
+        return decoded
+
+    def _backtracking(self, pointy_finger, pos):
+        '''
+        Backtracks from the state pointy_finger at undecided position pos
+        '''
+        seq = np.zeros(pos + 1, dtype=int)
+        seq[pos] = pointy_finger
+        while pos >= 1:
+            pointy_finger = self.pointers[pos - 1][pointy_finger]
+            pos -= 1
+            seq[pos] = pointy_finger
+        return seq
+
+    def _emit(self, seq):
+        '''
+        Removes the decoded positions from the buffer
+        '''
+        self.pointers = self.pointers[len(seq):]
+        self.n_decoded += len(seq)
+        return seq
+
+    def _emit_coalesced(self):
+        '''
+        Emits the positions where the survivor paths of all states coalesce
+        '''
+        survivors = np.arange(self.n_states)
+        for pos in reversed(range(len(self.pointers))):
+            survivors = self.pointers[pos][survivors]
+            if np.all(survivors == survivors[0]):
+                return self._emit(self._backtracking(survivors[0], pos))
+        return np.zeros(0, dtype=int)
+
+    def _emit_forced(self, n_positions):
+        '''
+        Emits the first n_positions undecided positions based on the current
+        best state
+        '''
+        seq = self._backtracking(np.argmax(self.scores),
+                self.n_pending() - 1)
+        return self._emit(seq[:n_positions])
+
+def decode_stream(chunks, emission_probs, transition_probs, starting_probs,
+        max_lag=None):
+    '''
+    Generator that decodes a stream of chunks of symbol indices
+    INPUTS:
+        - chunks: iterable of lists of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+        - max_lag: maximal number of undecided positions (default: None)
+    OUTPUT:
+        - yields arrays with the decoded states as soon as they are known
+    '''
+    decoder = StreamingViterbi(emission_probs, transition_probs,
+            starting_probs, max_lag)
+    for chunk in chunks:
+        decoded = decoder.update(chunk)
+        if len(decoded) > 0:
+            yield decoded
+    yield decoder.finish()
+
+def read_symbols(file, symbols, chunk_size=65536):
+    '''
+    Generator that reads a file of symbols (one character per symbol) in
+    chunks of symbol indices, whitespace is ignored
+    INPUTS:
+        - file: file object opened in text mode
+        - symbols: list of the symbols
+        - chunk_size: number of characters read at once (default: 65536)
+    '''
+    symbols_to_int = dict((s, i) for i, s in enumerate(symbols))
+    while True:
+        text = file.read(chunk_size)
+        if not text:
+            break
+        yield np.array([symbols_to_int[s] for s in text if not s.isspace()],
+                        dtype=int)
+
+
+
+if __name__=='__main__':
+
+    from io import StringIO
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    sequence = 'HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH'*5
+
+    print(sequence)
+    for decoded in decode_stream(read_symbols(StringIO(sequence), symbols, 10),
+                emis_probs, trans_probs, starting_probs):
+        print(int_to_states(decoded))
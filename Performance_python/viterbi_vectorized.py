@@ -0,0 +1,117 @@
+"""
+Created on Sun Oct 18 2026
+Last update: -
+
+@author: Michiel Stock
+michielfmstock@gmail.com
+
+Implementation of a HMM with Viterbi tracking, vectorized over the states
+
+The logarithms of the model are computed only once and every column of the
+dynamic programming matrix is filled using a single broadcasted max/argmax
+over the (prev_state x state) matrix.
+"""
+
+import numpy as np
+
+def log_model(emission_probs, transition_probs, starting_probs):
+    '''
+    Takes the logarithm of the parameters of the HMM (once)
+    INPUTS:
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+    OUTPUT:
+        - log_emission, log_transition, log_starting
+    '''
+    # zero probabilities become -inf, which is what we want
+    with np.errstate(divide='ignore'):
+        log_emission = np.log(np.asarray(emission_probs, dtype=float))
+        log_transition = np.log(np.asarray(transition_probs, dtype=float))
+        log_starting = np.log(np.asarray(starting_probs, dtype=float))
+    return log_emission, log_transition, log_starting
+
+def next_column(scores, log_transition, log_emission_symb):
+    '''
+    Computes the next column of the dynamic programming matrix
+    INPUTS:
+        - scores: previous column of the dynamic programming matrix
+        - log_transition: log of the transition probabilities
+        - log_emission_symb: log of the emission probabilities of the
+                current symbol (one per state)
+    OUTPUT:
+        - scores, pointers: the new column and the best previous states
+    '''
+    # element [prev_state, state]
+    log_probs = scores.reshape((-1, 1)) + log_transition +\
+            log_emission_symb.reshape((1, -1))
+    pointers = np.argmax(log_probs, axis=0)
+    return log_probs[pointers, np.arange(len(pointers))], pointers
+
+def fill_dyn_prog_matrix(seq_int, log_emission, log_transition,
+        log_starting, dyn_prog_matrix, pointers):
+    '''
+    Fills the dynamic programming matrix and the pointers column by column
+    '''
+    dyn_prog_matrix[:, 0] = log_starting + log_emission[seq_int[0]]
+    for i, symb in enumerate(seq_int[1:]):
+        dyn_prog_matrix[:, i+1], pointers[:, i+1] = next_column(
+                dyn_prog_matrix[:, i], log_transition, log_emission[symb])
+    return dyn_prog_matrix, pointers
+
+def viterbi(seq_int, emission_probs, transition_probs,
+        starting_probs):
+    '''
+    Generates the dynamic programming matrix for a sequence of symbols
+    INPUTS:
+        - seq_int: list of symbol indices
+        - emission_probs: emission_probabilities
+        - transition_probs: transition probabilities
+        - starting_probs: starting probabilities
+    '''
+    log_emission, log_transition, log_starting = log_model(emission_probs,
+            transition_probs, starting_probs)
+    n_states = log_transition.shape[0]
+    length_seq = len(seq_int)
+    dyn_prog_matrix = np.zeros((n_states, length_seq))
+    pointers = np.zeros((n_states, length_seq), dtype=int)
+    dyn_prog_matrix, pointers = fill_dyn_prog_matrix(seq_int, log_emission,
+            log_transition, log_starting, dyn_prog_matrix, pointers)
+    return backtracking(dyn_prog_matrix, pointers)
+
+def backtracking(dyn_prog_matrix, pointers):
+    '''
+    Uses backtracking to find the best sequence
+    '''
+    pos = dyn_prog_matrix.shape[1] - 1
+    seq = np.zeros(dyn_prog_matrix.shape[1], dtype=int)
+    pointy_finger = np.argmax(dyn_prog_matrix[:, -1])
+    seq[pos] = pointy_finger
+    while pos >= 1:
+        pointy_finger = pointers[pointy_finger, pos]
+        pos -= 1
+        seq[pos] = pointy_finger
+    return seq
+
+
+
+if __name__=='__main__':
+
+    symbols = ['H', 'T']
+    states = ['F', 'B']
+
+    emis_probs = np.array([[0.5, 0.1], [0.5, 0.9]])
+    trans_probs = np.array([[0.8, 0.2], [0.2, 0.8]])
+    starting_probs = np.array([0.99, 0.01])
+
+    symbols_to_int = lambda seq : np.array([symbols.index(s) for s in seq], dtype=int)
+    states_to_int = lambda seq : np.array([states.index(s) for s in seq], dtype=int)
+
+    int_to_symbols = lambda ints : ''.join(map(lambda i: symbols[i], ints))
+    int_to_states = lambda ints : ''.join(map(lambda i: states[i], ints))
+
+    sequence = 'HTHHTHHTTTHTTTTTTTTTHTTTHTTHTTHTHHHHTTTTTHHHTHHH'*5
+
+    print(sequence)
+    print(int_to_states(viterbi(symbols_to_int(sequence), emis_probs,\
+            trans_probs, starting_probs)))